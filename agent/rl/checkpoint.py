@@ -0,0 +1,101 @@
+import numpy as np
+import os
+import random
+"""
+Versioned training checkpoints of the linear Q agents, stored as a single .npz archive.
+Legacy .npy files holding a bare weight vector can still be loaded.
+"""
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path_file, w, rl_env, epoch=None, lr=None, exploration_rate=None):
+    """
+    Write weights, training state and RNG states of both random and np.random to path_file.
+    The archive is written to a temporary file first, so a preempted save never corrupts the last checkpoint.
+    :param epoch: the last finished epoch, None if training has not started or is over
+    """
+    py_version, py_keys, py_gauss = random.getstate()
+    np_name, np_keys, np_pos, np_has_gauss, np_gauss = np.random.get_state()
+    path_tmp = path_file + '.tmp'
+    with open(path_tmp, 'wb') as f:
+        np.savez(f, version=CHECKPOINT_VERSION, w=w, env=rl_env.__class__.__name__,
+                 epoch=-1 if epoch is None else epoch,
+                 lr=np.nan if lr is None else lr,
+                 exploration_rate=np.nan if exploration_rate is None else exploration_rate,
+                 py_random_version=py_version, py_random_keys=np.array(py_keys, dtype=np.uint64),
+                 py_random_gauss=np.nan if py_gauss is None else py_gauss,
+                 np_random_name=np_name, np_random_keys=np_keys, np_random_pos=np_pos,
+                 np_random_has_gauss=np_has_gauss, np_random_gauss=np_gauss)
+    os.replace(path_tmp, path_file)
+
+
+def load_checkpoint(path_file, rl_env=None, num_weights=None):
+    """
+    Read a checkpoint written by save_checkpoint, or a legacy .npy weight vector.
+    :param rl_env: if given, the checkpoint must have been trained with the same environment class
+    :param num_weights: if given, the expected length of the weight vector
+    :return: dict with version, w, env, epoch, lr, exploration_rate (None where unknown) and rng_states
+    """
+    data = np.load(path_file)
+    if isinstance(data, np.ndarray):
+        checkpoint = {'version': 0, 'w': data, 'env': None, 'epoch': None, 'lr': None,
+                      'exploration_rate': None, 'rng_states': None}
+    else:
+        with data:
+            version = int(data['version'])
+            if version > CHECKPOINT_VERSION:
+                raise ValueError('Checkpoint version %d is newer than supported version %d' %
+                                 (version, CHECKPOINT_VERSION))
+            py_gauss = float(data['py_random_gauss'])
+            checkpoint = {
+                'version': version,
+                'w': data['w'],
+                'env': str(data['env']),
+                'epoch': None if int(data['epoch']) < 0 else int(data['epoch']),
+                'lr': None if np.isnan(data['lr']) else float(data['lr']),
+                'exploration_rate': None if np.isnan(data['exploration_rate']) else float(data['exploration_rate']),
+                'rng_states': (
+                    (int(data['py_random_version']), tuple(int(key) for key in data['py_random_keys']),
+                     None if np.isnan(py_gauss) else py_gauss),
+                    (str(data['np_random_name']), data['np_random_keys'], int(data['np_random_pos']),
+                     int(data['np_random_has_gauss']), float(data['np_random_gauss']))),
+            }
+
+    if rl_env is not None and checkpoint['env'] is not None and checkpoint['env'] != rl_env.__class__.__name__:
+        raise ValueError('Checkpoint %s was trained with %s, not %s' %
+                         (path_file, checkpoint['env'], rl_env.__class__.__name__))
+    if num_weights is not None and len(checkpoint['w']) != num_weights:
+        raise ValueError('Checkpoint %s has %d weights, expected %d' % (path_file, len(checkpoint['w']), num_weights))
+    return checkpoint
+
+
+def save_training_checkpoint(path_file, w, rl_env, epoch, lr, exploration_rate):
+    """save_checkpoint at the end of a training epoch, reporting it."""
+    save_checkpoint(path_file, w, rl_env, epoch, lr, exploration_rate)
+    print('Saved checkpoint of epoch %d to %s' % (epoch, path_file))
+
+
+def resume_training(path_file, w, rl_env, lr, exploration_rate):
+    """
+    Load weights, training state and RNG states from path_file if it exists.
+    :param w: the initial weights, kept if there is no checkpoint; the checkpoint must have as many
+    :return: w, lr, exploration rate and the epoch to continue from
+    """
+    if not path_file or not os.path.exists(path_file):
+        return w, lr, exploration_rate, 0
+    checkpoint = load_checkpoint(path_file, rl_env, len(w))
+    restore_rng_states(checkpoint)
+    if checkpoint['epoch'] is None:  # Weights only: warm start
+        print('Warm start from weights of ' + path_file)
+        return checkpoint['w'], lr, exploration_rate, 0
+    print('Resume from epoch %d of %s' % (checkpoint['epoch'] + 1, path_file))
+    return checkpoint['w'], checkpoint['lr'], checkpoint['exploration_rate'], checkpoint['epoch'] + 1
+
+
+def restore_rng_states(checkpoint):
+    """Restore the states of random and np.random saved in checkpoint, if any."""
+    if checkpoint['rng_states'] is not None:
+        py_state, np_state = checkpoint['rng_states']
+        random.setstate(py_state)
+        np.random.set_state(np_state)
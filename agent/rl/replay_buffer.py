@@ -0,0 +1,85 @@
+import numpy as np
+"""
+Experience replay for the linear Q agents of rl_agent and rl_agentx.
+"""
+
+
+class ReplayBuffer:
+    def __init__(self, capacity, num_feats, prioritized=False, alpha=0.6, beta=0.4, eps=1e-3):
+        """
+        Ring buffer of transitions (feats, reward, next_feats, done) in preallocated arrays;
+        next_feats are the features of the greedy action in the next state.
+        :param capacity: maximum number of transitions; the oldest are overwritten
+        :param num_feats: length of the feature vectors
+        :param prioritized: sample transitions in proportion to their last TD error instead of uniformly
+        :param alpha: how strongly priorities shape the sampling (0 is uniform)
+        :param beta: exponent of the importance-sampling weights correcting prioritized sampling
+        :param eps: added to TD errors so that no transition stops being sampled
+        """
+        self.capacity = capacity
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+
+        self.feats = np.zeros((capacity, num_feats))
+        self.rewards = np.zeros(capacity)
+        self.next_feats = np.zeros((capacity, num_feats))
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.priorities = np.zeros(capacity)
+        self.index = 0  # slot of the next transition
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, feats, reward, next_feats, done):
+        """Store a transition with the highest priority seen so far, so it is replayed soon."""
+        self.feats[self.index] = feats
+        self.rewards[self.index] = reward
+        self.next_feats[self.index] = next_feats
+        self.dones[self.index] = done
+        self.priorities[self.index] = self.priorities[:self.size].max() if self.size else 1.
+        self.index = (self.index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def extend(self, transitions):
+        for transition in transitions:
+            self.add(*transition)
+
+    def sample(self, batch_size):
+        """
+        Draw a minibatch with replacement.
+        :return: indices, feats, rewards, next_feats, dones and importance-sampling weights (ones if uniform)
+        """
+        if self.size == 0:
+            raise ValueError('Cannot sample from an empty buffer')
+        if self.prioritized:
+            probs = self.priorities[:self.size] ** self.alpha
+            probs /= probs.sum()
+            indices = np.random.choice(self.size, batch_size, p=probs)
+            weights = (self.size * probs[indices]) ** -self.beta
+            weights /= weights.max()
+        else:
+            indices = np.random.randint(0, self.size, batch_size)
+            weights = np.ones(batch_size)
+        return indices, self.feats[indices], self.rewards[indices], self.next_feats[indices], \
+            self.dones[indices], weights
+
+    def update_priorities(self, indices, td_errors):
+        self.priorities[indices] = np.abs(td_errors) + self.eps
+
+    def td_update(self, w, batch_size, lr, discount):
+        """
+        Sample a minibatch and apply the mean TD update of the linear Q function to w in place.
+        :return: the TD errors of the minibatch
+        """
+        indices, feats, rewards, next_feats, dones, weights = self.sample(batch_size)
+        differences = rewards + discount * np.where(dones, 0., next_feats.dot(w)) - feats.dot(w)
+        w += lr * (weights * differences).dot(feats) / batch_size
+        if self.prioritized:
+            self.update_priorities(indices, differences)
+        return differences
+
+    def __str__(self):
+        return 'ReplayBuffer; size: %d/%d; prioritized: %s' % (self.size, self.capacity, self.prioritized)
@@ -1,13 +1,26 @@
 from agent.basic_agent import Agent, RandomAgent
 from agent.search.search_agent import AlphaBetaAgent
 from agent.rl.rl_env import RlEnv
+from agent.rl.replay_buffer import ReplayBuffer
+from agent.rl.checkpoint import save_checkpoint, load_checkpoint, save_training_checkpoint, resume_training
 import numpy as np
 from game.go import Board
 from game.go import opponent_color
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
 import random
+import time
 from statistics import mean
 
 
+def _generate_game(agent, exploration_rate, prob_oppo_random, board_size, max_moves, seed):
+    """Actor: play one seeded training game with a snapshot of the agent's weights."""
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    return agent.play_training_game(exploration_rate, prob_oppo_random, board_size, max_moves)
+
+
 class RlAgent(Agent):
     def __init__(self, color, rl_env):
         super().__init__(color)
@@ -30,27 +43,32 @@ class ApproxQAgent(RlAgent):
         if not legal_actions:
             return None
 
-        return max(legal_actions, key=lambda action: self._calc_q(board, action))
+        return legal_actions[int(np.argmax(self._calc_qs(board, legal_actions)))]
 
     def get_default_path(self):
-        return '%s.npy' % self.__class__.__name__
+        return '%s.npz' % self.__class__.__name__
+
+    def get_num_weights(self):
+        return self.rl_env.get_num_feats()
 
     def save(self, path_file=None):
-        """Save the weight vector."""
+        """Save the weight vector as a checkpoint without training state, see agent.rl.checkpoint."""
         if self.w is not None:
             if not path_file:
                 path_file = self.get_default_path()
-            np.save(path_file, self.w)
+            save_checkpoint(path_file, self.w, self.rl_env)
             print('Saved weights to ' + path_file)
 
     def load(self, path_file=None):
-        """Load the weight vector."""
+        """Load the weight vector of a checkpoint or a legacy .npy file, checking env and feature dimension."""
         if path_file is None:
             path_file = self.get_default_path()
-        self.w = np.load(path_file)
+        self.w = load_checkpoint(path_file, self.rl_env, self.get_num_weights())['w']
         print('Loaded weights from ' + path_file)
 
-    def train(self, epochs, lr, discount, exploration_rate, decay_rate=0.9, decay_epoch=200):
+    def train(self, epochs, lr, discount, exploration_rate, decay_rate=0.9, decay_epoch=200,
+              replay_capacity=None, batch_size=32, prioritized=False, checkpoint_path=None, checkpoint_epoch=100,
+              resume=False):
         """
         Use RandomAgent for opponent.
         :param epochs: one epoch = one game
@@ -59,6 +77,14 @@ class ApproxQAgent(RlAgent):
         :param exploration_rate: the probability to cause random move during training
         :param decay_rate: the rate to decay learning rate and exploration rate
         :param decay_epoch: the number of epochs to apply decay
+        :param replay_capacity: if set, store transitions in a ReplayBuffer of this size and learn from
+                                minibatches replayed from it instead of the latest transition only
+        :param batch_size: transitions per replayed minibatch
+        :param prioritized: replay transitions in proportion to their TD error
+        :param checkpoint_path: if set, save weights, lr, exploration rate, epoch and RNG states there
+                                every checkpoint_epoch epochs and at the end
+        :param checkpoint_epoch: the number of epochs between checkpoints
+        :param resume: continue from checkpoint_path if it exists; the replay buffer is not checkpointed
         :return:
         """
         if exploration_rate > 1 or exploration_rate < 0:
@@ -66,10 +92,16 @@ class ApproxQAgent(RlAgent):
 
         num_feats = self.rl_env.get_num_feats()
         self.w = np.random.random(num_feats)
+        replay_buffer = ReplayBuffer(replay_capacity, num_feats, prioritized) if replay_capacity else None
+
+        start_epoch = 0
+        if resume:
+            self.w, lr, exploration_rate, start_epoch = resume_training(checkpoint_path, self.w, self.rl_env,
+                                                                        lr, exploration_rate)
 
         print('Start training ' + str(self))
-        for epoch in range(epochs):
-            diff_mean = self._train_one_epoch(lr, discount, exploration_rate)
+        for epoch in range(start_epoch, epochs):
+            diff_mean = self._train_one_epoch(lr, discount, exploration_rate, replay_buffer, batch_size)
             # Decay learning rate and exploration rate
             if epoch % decay_epoch == decay_epoch - 1:
                 lr *= decay_rate
@@ -78,10 +110,14 @@ class ApproxQAgent(RlAgent):
                 print('Decay exploration rate to %f' % exploration_rate)
             # Echo performance
             if epoch % 5 == 4:
-                print('Epoch %d: mean difference %f' % (epoch, diff_mean))
+                print('Epoch %d: mean difference %f; feature cache hit rate %.3f' %
+                      (epoch, diff_mean, self.rl_env.cache_hit_rate))
+            if checkpoint_path and (epoch % checkpoint_epoch == checkpoint_epoch - 1 or epoch == epochs - 1):
+                save_training_checkpoint(checkpoint_path, self.w, self.rl_env, epoch, lr, exploration_rate)
         print('Finished training')
+        print(self.rl_env)
 
-    def _train_one_epoch(self, lr, discount, exploration_rate):
+    def _train_one_epoch(self, lr, discount, exploration_rate, replay_buffer=None, batch_size=32):
         """Return the mean of difference during this epoch"""
         # Opponent: minimax with random move
         prob_oppo_random = 0.4
@@ -96,17 +132,20 @@ class ApproxQAgent(RlAgent):
             board.put_stone(agent_oppo_random.get_action(board), check_legal=False)
 
         diffs = []
+        legal_actions = board.get_legal_actions()
+        feats_all = None  # Features of all legal actions, kept from the last step's next-state evaluation
         while board.winner is None:
-            legal_actions = board.get_legal_actions()
-
             # Get next action with exploration
             if random.uniform(0, 1) < exploration_rate:
                 action_next = random.choice(legal_actions)
             else:
-                action_next = max(legal_actions, key=lambda action: self._calc_q(board, action))
+                if feats_all is None:
+                    feats_all = self.rl_env.get_features_all(board, self.color, legal_actions)
+                # Scored again, as the weights have been updated since
+                action_next = legal_actions[int(np.argmax(feats_all.dot(self.w)))]
 
             # Keep current features
-            feats = self.rl_env.extract_features(board, action_next, self.color)
+            feats = self.rl_env.get_features(board, action_next, self.color)
             q = self.w.dot(feats)
 
             # Apply next action
@@ -122,24 +161,182 @@ class ApproxQAgent(RlAgent):
             # Calc difference
             reward_now = self.rl_env.get_reward(board, self.color)
             reward_future = 0
+            next_feats = 0.
             if board.winner is None:
-                next_legal_actions = board.get_legal_actions()
-                next_qs = [self._calc_q(board, action) for action in next_legal_actions]
-                reward_future = max(next_qs)
+                legal_actions = board.get_legal_actions()
+                feats_all = self.rl_env.get_features_all(board, self.color, legal_actions)
+                next_qs = feats_all.dot(self.w)
+                reward_future = next_qs.max()
+                if replay_buffer is not None:
+                    next_feats = feats_all[int(np.argmax(next_qs))]
             difference = reward_now + discount * reward_future - q
             diffs.append(difference)
 
-            # Apply weight update
-            self.w += (lr * difference * feats)
+            # Apply weight update, or replay a minibatch of stored transitions
+            if replay_buffer is None:
+                self.w += (lr * difference * feats)
+            else:
+                replay_buffer.add(feats, reward_now, next_feats, board.winner is not None)
+                if len(replay_buffer) >= batch_size:
+                    replay_buffer.td_update(self.w, batch_size, lr, discount)
 
         return mean(diffs)
 
+    def train_parallel(self, epochs, lr, discount, exploration_rate, decay_rate=0.9, decay_epoch=200,
+                       num_workers=None, prob_oppo_random=0.4, board_size=19, max_moves=None, log_epoch=10, seed=0,
+                       replay_capacity=None, batch_size=32, prioritized=False, checkpoint_path=None,
+                       checkpoint_epoch=100, resume=False):
+        """
+        Train with an actor/learner split: worker processes play the training games with a snapshot
+        of the weights, while this process applies the TD updates of each game in order and sends
+        the latest weights with every new game.
+        :param epochs: one epoch = one game
+        :param num_workers: number of actor processes; default all cores
+        :param prob_oppo_random: the probability that the opponent plays a random move instead of minimax
+        :param max_moves: stop a game after this many moves, see play_training_game
+        :param log_epoch: the number of epochs between throughput reports
+        :param seed: each game is seeded from seed and its epoch; the weights a game is played with
+                     depend on the number of workers, as actors run ahead of the learner
+        (others as in train)
+        """
+        if exploration_rate > 1 or exploration_rate < 0:
+            raise ValueError('exploration_rate should be in [0, 1]!')
+
+        num_feats = self.rl_env.get_num_feats()
+        self.w = np.random.random(num_feats)
+        num_workers = num_workers or os.cpu_count()
+        replay_buffer = ReplayBuffer(replay_capacity, num_feats, prioritized) if replay_capacity else None
+        start_epoch = 0
+        if resume:
+            self.w, lr, exploration_rate, start_epoch = resume_training(checkpoint_path, self.w, self.rl_env,
+                                                                        lr, exploration_rate)
+
+        print('Start parallel training %s with %d actors' % (self, num_workers))
+        time_start = time.time()
+        num_transitions = 0
+        diffs = []
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            pending = deque()
+            for epoch in range(start_epoch, epochs):
+                # Keep every actor busy with a game played on the current weights
+                while len(pending) < num_workers and epoch + len(pending) < epochs:
+                    pending.append(executor.submit(_generate_game, self, exploration_rate, prob_oppo_random,
+                                                   board_size, max_moves, seed * 1000003 + epoch + len(pending)))
+                transitions = pending.popleft().result()
+                diffs.extend(self._learn(transitions, lr, discount, replay_buffer, batch_size))
+                num_transitions += len(transitions)
+
+                # Decay learning rate and exploration rate
+                if epoch % decay_epoch == decay_epoch - 1:
+                    lr *= decay_rate
+                    exploration_rate *= decay_rate
+                    print('Decay learning rate to %f' % lr)
+                    print('Decay exploration rate to %f' % exploration_rate)
+                # Echo performance and throughput
+                if epoch % log_epoch == log_epoch - 1:
+                    time_elapsed = time.time() - time_start
+                    print('Epoch %d: mean difference %f; %.1f games/hour; %.1f transitions/s' %
+                          (epoch, mean(diffs), (epoch + 1 - start_epoch) * 3600 / time_elapsed,
+                           num_transitions / time_elapsed))
+                    diffs = []
+                if checkpoint_path and (epoch % checkpoint_epoch == checkpoint_epoch - 1 or epoch == epochs - 1):
+                    save_training_checkpoint(checkpoint_path, self.w, self.rl_env, epoch, lr, exploration_rate)
+        print('Finished training')
+
+    def play_training_game(self, exploration_rate, prob_oppo_random=0.4, board_size=19, max_moves=None):
+        """
+        Play one training game against minimax or random moves without updating the weights.
+        The game ends with a winner, when self has no legal action, or after max_moves moves
+        (default twice the number of points); then the winner is decided by score.
+        :return: list of transitions (feats, reward, next_feats, done), where next_feats are the features
+                 of the greedy action in the next state (zeros once done)
+        """
+        agent_oppo = AlphaBetaAgent(opponent_color(self.color), depth=1)
+        agent_oppo_random = RandomAgent(opponent_color(self.color))
+        num_feats = self.rl_env.get_num_feats()
+
+        board = Board(board_size)
+        max_moves = max_moves or 2 * board_size * board_size
+        first_move = (board_size // 2 + 1, board_size // 2 + 1)
+        board.put_stone(first_move, check_legal=False)
+
+        if board.next != self.color:
+            self._play(board, agent_oppo_random.get_action(board))
+
+        transitions = []
+        legal_actions = board.get_legal_actions()
+        qs = self._calc_qs(board, legal_actions)
+        while legal_actions:
+            # Get next action with exploration
+            if random.uniform(0, 1) < exploration_rate:
+                action_next = random.choice(legal_actions)
+            else:
+                action_next = legal_actions[int(np.argmax(qs))]
+            feats = self.rl_env.get_features(board, action_next, self.color)
+
+            # Apply next action, then let opponent play
+            self._play(board, action_next)
+            if board.winner is None:
+                if random.uniform(0, 1) < prob_oppo_random:
+                    self._play(board, agent_oppo_random.get_action(board))
+                else:
+                    self._play(board, agent_oppo.get_action(board))
+
+            legal_actions = board.get_legal_actions() if board.winner is None else []
+            done = not legal_actions or board.counter_move >= max_moves
+            if done:
+                transitions.append((feats, self._get_final_reward(board), np.zeros(num_feats), True))
+                break
+            qs = self._calc_qs(board, legal_actions)
+            next_feats = self.rl_env.get_features(board, legal_actions[int(np.argmax(qs))], self.color)
+            transitions.append((feats, self.rl_env.get_reward(board, self.color), next_feats, False))
+        return transitions
+
+    def _learn(self, transitions, lr, discount, replay_buffer=None, batch_size=32):
+        """
+        Apply the TD update of each transition in order, or with a replay buffer,
+        store each transition and replay one minibatch; return the differences of the transitions.
+        """
+        diffs = []
+        for feats, reward, next_feats, done in transitions:
+            reward_future = 0 if done else self.w.dot(next_feats)
+            difference = reward + discount * reward_future - self.w.dot(feats)
+            if replay_buffer is None:
+                self.w += (lr * difference * feats)
+            else:
+                replay_buffer.add(feats, reward, next_feats, done)
+                if len(replay_buffer) >= batch_size:
+                    replay_buffer.td_update(self.w, batch_size, lr, discount)
+            diffs.append(difference)
+        return diffs
+
+    def _get_final_reward(self, board):
+        """Reward of a finished game: by winner, else by score."""
+        if board.winner is None:
+            score = board.get_score()
+            winner = 'BLACK' if score['BLACK'] > score['WHITE'] else 'WHITE'
+            return 10 if winner == self.color else -10
+        return self.rl_env.get_reward(board, self.color)
+
+    @staticmethod
+    def _play(board, action):
+        """Put a stone, or pass if there is no action."""
+        if action is None:
+            board.pass_move()
+        else:
+            board.put_stone(action, check_legal=False)
+
     def _calc_q(self, board, action):
-        return self.w.dot(self.rl_env.extract_features(board, action, self.color))
+        return self.w.dot(self.rl_env.get_features(board, action, self.color))
+
+    def _calc_qs(self, board, actions):
+        """Q values of all actions with one matrix-vector product."""
+        return self.rl_env.get_features_all(board, self.color, actions).dot(self.w)
 
 
 if __name__ == '__main__':
     # Train and save ApproxQAgent
     approx_q_agent = ApproxQAgent('BLACK', RlEnv())
-    approx_q_agent.train(2000, 0.001, 0.9, 0.1)
+    approx_q_agent.train(2000, 0.001, 0.9, 0.1, checkpoint_path='ApproxQAgent_checkpoint.npz', resume=True)
+    # approx_q_agent.train_parallel(2000, 0.001, 0.9, 0.1)  # Games played by actors on all cores
     approx_q_agent.save()
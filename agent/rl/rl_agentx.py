@@ -1,6 +1,8 @@
 from agent.basic_agent import Agent, RandomAgent
 from agent.search.search_agent import AlphaBetaAgent
 from agent.rl.rl_env import RlEnv2
+from agent.rl.replay_buffer import ReplayBuffer
+from agent.rl.checkpoint import save_checkpoint, load_checkpoint, save_training_checkpoint, resume_training
 import numpy as np
 from game.go import Board
 from game.go import opponent_color
@@ -30,27 +32,32 @@ class ApproxQAgent(RlAgent):
         if not legal_actions:
             return None
 
-        return max(legal_actions, key=lambda action: self._calc_q(board, action))
+        return legal_actions[int(np.argmax(self._calc_qs(board, legal_actions)))]
 
     def get_default_path(self):
-        return '%s_%s.npy' % (self.__class__.__name__, self.color)
+        return '%s_%s.npz' % (self.__class__.__name__, self.color)
+
+    def get_num_weights(self):
+        return 2 * self.rl_env.get_num_feats()
 
     def save(self, path_file=None):
-        """Save the weight vector."""
+        """Save the weight vector as a checkpoint without training state, see agent.rl.checkpoint."""
         if self.w is not None:
             if not path_file:
                 path_file = self.get_default_path()
-            np.save(path_file, self.w)
+            save_checkpoint(path_file, self.w, self.rl_env)
             print('Saved weights to ' + path_file)
 
     def load(self, path_file=None):
-        """Load the weight vector."""
+        """Load the weight vector of a checkpoint or a legacy .npy file, checking env and feature dimension."""
         if path_file is None:
             path_file = self.get_default_path()
-        self.w = np.load(path_file)
+        self.w = load_checkpoint(path_file, self.rl_env, self.get_num_weights())['w']
         print('Loaded weights from ' + path_file)
 
-    def train(self, epochs, lr, discount, exploration_rate, decay_rate=0.9, decay_epoch=500):
+    def train(self, epochs, lr, discount, exploration_rate, decay_rate=0.9, decay_epoch=500,
+              replay_capacity=None, batch_size=32, prioritized=False, checkpoint_path=None, checkpoint_epoch=100,
+              resume=False):
         """
         Use RandomAgent for opponent.
         :param epochs: one epoch = one game
@@ -59,6 +66,14 @@ class ApproxQAgent(RlAgent):
         :param exploration_rate: the probability to cause self random move during training
         :param decay_rate: the rate to decay learning rate and exploration rate
         :param decay_epoch: the number of epochs to apply decay
+        :param replay_capacity: if set, store transitions in a ReplayBuffer of this size and learn from
+                                minibatches replayed from it instead of the latest transition only
+        :param batch_size: transitions per replayed minibatch
+        :param prioritized: replay transitions in proportion to their TD error
+        :param checkpoint_path: if set, save weights, lr, exploration rate, epoch and RNG states there
+                                every checkpoint_epoch epochs and at the end
+        :param checkpoint_epoch: the number of epochs between checkpoints
+        :param resume: continue from checkpoint_path if it exists; the replay buffer is not checkpointed
         :return:
         """
         if exploration_rate > 1 or exploration_rate < 0:
@@ -66,10 +81,16 @@ class ApproxQAgent(RlAgent):
 
         num_feats = self.rl_env.get_num_feats()
         self.w = np.array([-1]+[-0.5]*(-1+num_feats)+[0.8]+[0.4]*(-1+num_feats))
+        replay_buffer = ReplayBuffer(replay_capacity, len(self.w), prioritized) if replay_capacity else None
+
+        start_epoch = 0
+        if resume:
+            self.w, lr, exploration_rate, start_epoch = resume_training(checkpoint_path, self.w, self.rl_env,
+                                                                        lr, exploration_rate)
 
         print('Start training ' + str(self))
-        for epoch in range(epochs):
-            diff_mean = self._train_one_epoch(lr, discount, exploration_rate)
+        for epoch in range(start_epoch, epochs):
+            diff_mean = self._train_one_epoch(lr, discount, exploration_rate, replay_buffer, batch_size)
             # Decay learning rate and exploration rate
             if epoch % decay_epoch == decay_epoch - 1:
                 lr *= decay_rate
@@ -78,10 +99,14 @@ class ApproxQAgent(RlAgent):
                 print('Decay exploration rate to %f' % exploration_rate)
             # Echo performance
             if epoch % 5 == 4:
-                print('Epoch %d: mean difference %f' % (epoch, diff_mean))
+                print('Epoch %d: mean difference %f; feature cache hit rate %.3f' %
+                      (epoch, diff_mean, self.rl_env.cache_hit_rate))
+            if checkpoint_path and (epoch % checkpoint_epoch == checkpoint_epoch - 1 or epoch == epochs - 1):
+                save_training_checkpoint(checkpoint_path, self.w, self.rl_env, epoch, lr, exploration_rate)
         print('Finished training')
+        print(self.rl_env)
 
-    def _train_one_epoch(self, lr, discount, exploration_rate):
+    def _train_one_epoch(self, lr, discount, exploration_rate, replay_buffer=None, batch_size=32):
         """Return the mean of difference during this epoch"""
         # Opponent: minimax with random move
         prob_oppo_random = 0.1
@@ -96,16 +121,20 @@ class ApproxQAgent(RlAgent):
             board.put_stone(agent_oppo_random.get_action(board), check_legal=False)
 
         diffs = []
+        legal_actions = board.get_legal_actions()
+        feats_all = None  # Features of all legal actions, kept from the last step's next-state evaluation
         while board.winner is None:
-            legal_actions = board.get_legal_actions()
             # Get next action with exploration
             if random.uniform(0, 1) < exploration_rate:
                 action_next = random.choice(legal_actions)
             else:
-                action_next = max(legal_actions, key=lambda action: self._calc_q(board, action))
+                if feats_all is None:
+                    feats_all = self._extract_signed_features_all(board, legal_actions)
+                # Scored again, as the weights have been updated since
+                action_next = legal_actions[int(np.argmax(feats_all.dot(self.w)))]
 
             # Keep current features
-            feats ,isself = self.rl_env.extract_features(board, action_next, self.color)
+            feats ,isself = self.rl_env.get_features(board, action_next, self.color)
             if isself:
                 q=self.w.dot(feats)
             else:
@@ -122,15 +151,24 @@ class ApproxQAgent(RlAgent):
             # Calc difference
             reward_now = self.rl_env.get_reward(board, self.color)
             reward_future = 0
+            next_feats = 0.
             if board.winner is None:
-                next_legal_actions = board.get_legal_actions()
-                next_qs = [self._calc_q(board, action) for action in next_legal_actions]
-                reward_future = max(next_qs)
+                legal_actions = board.get_legal_actions()
+                feats_all = self._extract_signed_features_all(board, legal_actions)
+                next_qs = feats_all.dot(self.w)
+                reward_future = next_qs.max()
+                if replay_buffer is not None:
+                    next_feats = feats_all[int(np.argmax(next_qs))]
             difference = reward_now + discount * reward_future - q
             diffs.append(difference)
 
-            # Apply weight update
-            if isself:
+            # Apply weight update, or replay a minibatch of stored transitions
+            if replay_buffer is not None:
+                signed_feats = feats if isself else -self.rl_env.reverse_features(feats)
+                replay_buffer.add(signed_feats, reward_now, next_feats, board.winner is not None)
+                if len(replay_buffer) >= batch_size:
+                    replay_buffer.td_update(self.w, batch_size, lr, discount)
+            elif isself:
                 self.w += (lr * difference * feats)
             else:
                 self.w -= (lr * difference * self.rl_env.reverse_features(feats))
@@ -138,12 +176,21 @@ class ApproxQAgent(RlAgent):
         return mean(diffs)
 
     def _calc_q(self, board, action):
-        feats,isself = self.rl_env.extract_features(board, action, self.color)
+        feats,isself = self.rl_env.get_features(board, action, self.color)
         if isself:
             return  self.w.dot(feats)
         else:
             return  -self.w.dot(self.rl_env.reverse_features(feats))
 
+    def _extract_signed_features_all(self, board, actions):
+        """Features of all actions as one matrix, with each row f such that _calc_q == w.dot(f)."""
+        feats_all, isself_all = self.rl_env.get_features_all(board, self.color, actions)
+        return np.where(isself_all[:, None], feats_all, -self.rl_env.reverse_features(feats_all))
+
+    def _calc_qs(self, board, actions):
+        """Q values of all actions with one matrix-vector product."""
+        return self._extract_signed_features_all(board, actions).dot(self.w)
+
 
 if __name__ == '__main__':
     # Train and save ApproxQAgent
@@ -1,6 +1,8 @@
-from game.go import Board, opponent_color
-from agent.util import get_num_endangered_groups, get_liberties, is_dangerous_liberty, \
-    get_num_groups_with_k_liberties, calc_group_liberty_var, get_group_scores, get_liberty_score
+from game.go import Board, opponent_color, COLOR_CODES
+from agent.util import get_num_endangered_groups, get_dangerous_liberties, get_num_shared_liberties, \
+    get_num_groups_with_k_liberties, calc_group_liberty_var, get_group_scores, get_liberty_score, \
+    stack_boards, get_batch_group_features
+from collections import OrderedDict
 import numpy as np
 """
 Environment for rl_agent.
@@ -8,8 +10,85 @@ Environment for rl_agent.
 
 
 class RlEnvBase:
-    def __init__(self):
-        pass
+    def __init__(self, cache_size=50000):
+        """
+        :param cache_size: maximum number of feature vectors kept by get_features/get_features_all,
+                           keyed by (position, action, color), least recently used evicted first; 0 disables it
+        """
+        self.cache_size = cache_size
+        self.feature_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
+    def __getstate__(self):
+        # Do not ship the cache to worker processes with every pickled agent
+        state = self.__dict__.copy()
+        state['feature_cache'] = OrderedDict()
+        return state
+
+    def get_features(self, board: Board, action, color):
+        """extract_features through the feature cache"""
+        key = (board.situation_hash, action, color)
+        feats = self._get_cached(key)
+        if feats is None:
+            feats = self.extract_features(board, action, color)
+            self._put_cached(key, feats)
+        return feats
+
+    def get_features_all(self, board: Board, color, actions=None):
+        """extract_features_all through the feature cache; only the actions not cached are extracted"""
+        if actions is None:
+            actions = board.get_legal_actions()
+        keys = [(board.situation_hash, action, color) for action in actions]
+        feats_all = [self._get_cached(key) for key in keys]
+        missing = [i for i, feats in enumerate(feats_all) if feats is None]
+        if missing:
+            extracted = self._extract_successor_features_all(board, color, [actions[i] for i in missing],
+                                                             **self._get_extract_options())
+            for i, feats in zip(missing, extracted):
+                feats_all[i] = feats
+                self._put_cached(keys[i], feats)
+        return self._stack_features(feats_all)
+
+    def _get_extract_options(self):
+        """Keyword arguments of _extract_successor_features_all set up by the constructor"""
+        return {}
+
+    def _get_cached(self, key):
+        feats = self.feature_cache.get(key)
+        if feats is None:
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+            self.feature_cache.move_to_end(key)
+        return feats
+
+    def _put_cached(self, key, feats):
+        if self.cache_size <= 0:
+            return
+        self.feature_cache[key] = feats
+        if len(self.feature_cache) > self.cache_size:
+            self.feature_cache.popitem(last=False)
+            self.cache_evictions += 1
+
+    def clear_cache(self):
+        self.feature_cache.clear()
+        self.cache_hits = self.cache_misses = self.cache_evictions = 0
+
+    @property
+    def cache_hit_rate(self):
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.
+
+    def get_cache_stats(self):
+        return {'size': len(self.feature_cache), 'max_size': self.cache_size, 'hits': self.cache_hits,
+                'misses': self.cache_misses, 'hit_rate': self.cache_hit_rate, 'evictions': self.cache_evictions}
+
+    def __str__(self):
+        return '%s; feature cache size: %d/%d; hits: %d; misses: %d; hit rate: %.3f; evictions: %d' % \
+               (self.__class__.__name__, len(self.feature_cache), self.cache_size, self.cache_hits,
+                self.cache_misses, self.cache_hit_rate, self.cache_evictions)
 
     @classmethod
     def get_reward(cls, board: Board, color):
@@ -22,100 +101,228 @@ class RlEnvBase:
     def extract_features(cls, board: Board, action, color):
         raise NotImplementedError
 
+    @classmethod
+    def extract_features_all(cls, board: Board, color, actions=None):
+        """
+        Return the features of all actions (default: legal actions of board) as an A x F matrix.
+        Each action is played and taken back on one copy of board instead of generating a successor per action.
+        """
+        return cls._stack_features(cls._extract_successor_features_all(board, color, actions))
+
+    @classmethod
+    def _extract_successor_features_all(cls, board: Board, color, actions=None):
+        """Return the list of what extract_features returns for each action"""
+        if actions is None:
+            actions = board.get_legal_actions()
+        board = board.copy()
+        shared = cls._new_shared_work()
+        feats_all = []
+        for action in actions:
+            board.play(action)
+            feats_all.append(cls._extract_successor_features(board, color, **shared))
+            board.undo()
+        return feats_all
+
+    @classmethod
+    def _new_shared_work(cls):
+        """Keyword arguments of _extract_successor_features shared by the successors of one position"""
+        return {}
+
+    @classmethod
+    def _stack_features(cls, feats_all):
+        return np.array(feats_all)
+
+    @classmethod
+    def _extract_successor_features(cls, board: Board, color):
+        """Features of board, the successor state after color's action."""
+        raise NotImplementedError
+
     @classmethod
     def get_num_feats(cls):
         raise NotImplementedError
 
 
 class RlEnv(RlEnvBase):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, cache_size=50000, batch_group_features=True):
+        """
+        :param batch_group_features: get_features_all takes the group and liberty features of all successors
+                                     from one get_batch_group_features call per color; False extracts them
+                                     from the incremental board aggregates of each successor
+        """
+        super().__init__(cache_size)
+        self.batch_group_features = batch_group_features
+
+    def _get_extract_options(self):
+        return {'batch_group_features': self.batch_group_features}
 
     @classmethod
     def extract_features(cls, board: Board, action, color):
         """Return a numpy array of features"""
-        board = board.generate_successor_state(action)
+        return cls._extract_successor_features(board.generate_successor_state(action), color)
+
+    @classmethod
+    def extract_features_all(cls, board: Board, color, actions=None, batch_group_features=True):
+        """See RlEnvBase.extract_features_all; batch_group_features as in the constructor"""
+        return cls._stack_features(cls._extract_successor_features_all(board, color, actions, batch_group_features))
+
+    @classmethod
+    def _extract_successor_features_all(cls, board: Board, color, actions=None, batch_group_features=True):
+        if not batch_group_features:
+            return super()._extract_successor_features_all(board, color, actions)
+        if actions is None:
+            actions = board.get_legal_actions()
+        if not actions:
+            return []
         oppo = opponent_color(color)
 
+        # Only the features that need the liberty dict are extracted while each action is played
+        board = board.copy()
+        grid_parent = board.to_array()
+        grids = []
+        exist_guarantee_winning_all = []
+        for action in actions:
+            code = COLOR_CODES[board.next]
+            _, captured_points = board.play(action)
+            # The successor grid differs from the parent only in the stone played and the stones captured
+            grid = grid_parent.copy()
+            if action is not None:
+                grid[action] = code
+            for point in captured_points:
+                grid[point] = 0
+            grids.append(grid)
+            exist_guarantee_winning_all.append(None if board.winner == color else
+                                               cls._exist_guarantee_winning(board, color))
+            board.undo()
+
+        # Group and liberty features of all successors, one pass per color
+        grids = stack_boards(grids)
+        group_feats_self = get_batch_group_features(grids, color)
+        group_feats_oppo = get_batch_group_features(grids, oppo)
+
+        def pair(key, i):
+            return group_feats_self[key][i], group_feats_oppo[key][i]
+
+        feats_all = []
+        for i, exist_guarantee_winning in enumerate(exist_guarantee_winning_all):
+            if exist_guarantee_winning is None:
+                feats_all.append(cls._get_win_features())
+            else:
+                feats_all.append(cls._combine_features(
+                    pair('num_endangered', i), group_feats_self['num_dangerous_liberties'][i] > 0,
+                    exist_guarantee_winning, pair('num_groups_2lbt', i), pair('num_shared_liberties', i),
+                    pair('num_groups', i), pair('liberty_var_mean', i)))
+        return feats_all
+
+    @classmethod
+    def _new_shared_work(cls):
+        # A move changes few groups, so the liberty variance of most groups is shared by all successors
+        return {'liberty_vars': {}}
+
+    @classmethod
+    def _extract_successor_features(cls, board: Board, color, liberty_vars=None):
         # Features for win
-        feat_win = 1 if board.winner == color else 0
-        if feat_win == 1:
-            return np.array([feat_win] + [0] * (cls.get_num_feats() - 1))
+        if board.winner == color:
+            return cls._get_win_features()
+
+        oppo = opponent_color(color)
+        var_self = [cls._get_liberty_var(group, liberty_vars) for group in board.groups[color]]
+        var_oppo = [cls._get_liberty_var(group, liberty_vars) for group in board.groups[oppo]]
+        return cls._combine_features(get_num_endangered_groups(board, color),
+                                     bool(get_dangerous_liberties(board, color)),
+                                     cls._exist_guarantee_winning(board, color),
+                                     get_num_groups_with_k_liberties(board, color, 2),
+                                     get_num_shared_liberties(board, color),
+                                     (len(board.groups[color]), len(board.groups[oppo])),
+                                     (np.mean(var_self), np.mean(var_oppo)))
+
+    @classmethod
+    def _get_win_features(cls):
+        return np.array([1] + [0] * (cls.get_num_feats() - 1))
+
+    @staticmethod
+    def _exist_guarantee_winning(board: Board, color):
+        """Whether an opponent dangerous liberty cannot be saved, as none of its groups' liberties touch color"""
+        oppo = opponent_color(color)
+        for liberty in get_dangerous_liberties(board, oppo):
+            oppo_groups = board.libertydict.get_groups(oppo, liberty)
+            liberties = oppo_groups[0].liberties | oppo_groups[1].liberties
+            able_to_save = False
+            for lbt in liberties:
+                if len(board.libertydict.get_groups(color, lbt)) > 0:
+                    able_to_save = True
+                    break
+            if not able_to_save:
+                return True
+        return False
 
+    @classmethod
+    def _combine_features(cls, num_endangered, exist_dangerous_self, exist_guarantee_winning, num_groups_2lbt,
+                          num_shared_liberties, num_groups, var_means):
+        """Return the feature array of a successor that is not won; the counts and means are (self, opponent)."""
         # Features for endangered groups
-        num_endangered_self, num_endangered_oppo = get_num_endangered_groups(board, color)
+        num_endangered_self, num_endangered_oppo = num_endangered
         feat_exist_endangered_self = 1 if num_endangered_self > 0 else 0
         feat_more_than_one_endangered_oppo = 1 if num_endangered_oppo > 1 else 0
 
         # Features for dangerous liberties
-        feat_exist_guarantee_losing = 0
-        feat_exist_guarantee_winning = 0
-        liberties_self, liberties_oppo = get_liberties(board, color)
-        for liberty in liberties_self:
-            if is_dangerous_liberty(board, liberty, color):
-                feat_exist_guarantee_losing = 1
-                break
-        for liberty in liberties_oppo:
-            if is_dangerous_liberty(board, liberty, oppo):
-                oppo_groups = board.libertydict.get_groups(oppo, liberty)
-                liberties = oppo_groups[0].liberties | oppo_groups[1].liberties
-                able_to_save = False
-                for lbt in liberties:
-                    if len(board.libertydict.get_groups(color, lbt)) > 0:
-                        able_to_save = True
-                        break
-                if not able_to_save:
-                    feat_exist_guarantee_winning = 1
-                    break
+        feat_exist_guarantee_losing = 1 if exist_dangerous_self else 0
+        feat_exist_guarantee_winning = 1 if exist_guarantee_winning else 0
 
         # Features for groups
-        num_groups_2lbt_self, num_groups_2lbt_oppo = get_num_groups_with_k_liberties(board, color, 2)
+        num_groups_2lbt_self, num_groups_2lbt_oppo = num_groups_2lbt
         feat_groups_2lbt = num_groups_2lbt_oppo - num_groups_2lbt_self
 
         # Features for shared liberties
-        num_shared_liberties_self = 0
-        num_shared_liberties_oppo = 0
-        for liberty in liberties_self:
-            num_shared_liberties_self += len(board.libertydict.get_groups(color, liberty)) - 1
-        for liberty in liberties_oppo:
-            num_shared_liberties_oppo += len(board.libertydict.get_groups(oppo, liberty)) - 1
+        num_shared_liberties_self, num_shared_liberties_oppo = num_shared_liberties
         feat_shared_liberties = num_shared_liberties_oppo - num_shared_liberties_self
 
         # Features for number of groups
-        feat_num_groups_diff = len(board.groups[color]) - len(board.groups[oppo])
+        feat_num_groups_diff = num_groups[0] - num_groups[1]
 
         # Features for liberty variance
-        var_self, var_oppo = [], []
-        for group in board.groups[color]:
-            var_self.append(calc_group_liberty_var(group))
-        for group in board.groups[oppo]:
-            var_oppo.append(calc_group_liberty_var(group))
-        feat_var_self_mean = np.mean(var_self)
-        feat_var_oppo_mean = np.mean(var_oppo)
-
-        feats = [feat_win, feat_exist_endangered_self, feat_more_than_one_endangered_oppo,
+        feat_var_self_mean, feat_var_oppo_mean = var_means
+
+        feats = [0, feat_exist_endangered_self, feat_more_than_one_endangered_oppo,
                  feat_exist_guarantee_losing, feat_exist_guarantee_winning, feat_groups_2lbt,
                  feat_shared_liberties, feat_num_groups_diff, feat_var_self_mean,
                  feat_var_oppo_mean, 1]  # Add bias
         return np.array(feats)
 
+    @staticmethod
+    def _get_liberty_var(group, liberty_vars=None):
+        """calc_group_liberty_var, memoized by liberties in liberty_vars if given"""
+        if liberty_vars is None:
+            return calc_group_liberty_var(group)
+        key = frozenset(group.liberties)
+        if key not in liberty_vars:
+            liberty_vars[key] = calc_group_liberty_var(group)
+        return liberty_vars[key]
+
     @classmethod
     def get_num_feats(cls):
         return 11
 
 
 class RlEnv2(RlEnvBase):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, cache_size=50000):
+        super().__init__(cache_size)
 
     @classmethod
     def extract_features(cls, board: Board, action, color, isself=True, generatesuccessor=True):
-        
         """Return a numpy array of features"""
         if generatesuccessor:
             board = board.generate_successor_state(action)
         else:
             board.put_stone(action)
+        return cls._extract_successor_features(board, color, isself)
+
+    @classmethod
+    def _stack_features(cls, feats_all):
+        """Return the A x F feature matrix, and whether each row is from color's view"""
+        return np.array([feats for feats, _ in feats_all]), np.array([isself for _, isself in feats_all], dtype=bool)
+
+    @classmethod
+    def _extract_successor_features(cls, board: Board, color, isself=True):
         oppo = opponent_color(color)
         
         if board.winner == color:
@@ -132,7 +339,10 @@ class RlEnv2(RlEnvBase):
             return np.array([1] + [0] * (cls.get_num_feats() * 2 - 1)) , isself # Doomed to lose
 
         elif len(board.legal_actions) == 1: #One choice only
-            return cls.extract_features(board, board.legal_actions[0], oppo, not isself, False)
+            board.play(board.legal_actions[0])
+            feats = cls._extract_successor_features(board, oppo, not isself)
+            board.undo()
+            return feats
         
         elif num_endangered_oppo>1: 
             return np.array([0] * (cls.get_num_feats()) + [1] + [0] * (cls.get_num_feats() - 1)) , isself # Doomed to win 
@@ -158,13 +368,14 @@ class RlEnv2(RlEnvBase):
     
     @classmethod
     def reverse_features(cls, feat):
+        """Swap the self and opponent halves of a feature vector, or of each row of a feature matrix"""
         length=cls.get_num_feats()
-        return np.concatenate((feat[length:], feat[:length]))
+        return np.concatenate((feat[..., length:], feat[..., :length]), axis=-1)
 
 
 class RlEnv3(RlEnvBase):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, cache_size=50000):
+        super().__init__(cache_size)
 
     @classmethod
     def extract_features(cls, board: Board, action, color, isself=True, generatesuccessor=True):
@@ -173,6 +384,15 @@ class RlEnv3(RlEnvBase):
             board = board.generate_successor_state(action)
         else:
             board.put_stone(action)
+        return cls._extract_successor_features(board, color, isself)
+
+    @classmethod
+    def _stack_features(cls, feats_all):
+        """Return the A x F feature matrix, and whether each row is from color's view"""
+        return np.array([feats for feats, _ in feats_all]), np.array([isself for _, isself in feats_all], dtype=bool)
+
+    @classmethod
+    def _extract_successor_features(cls, board: Board, color, isself=True):
         oppo = opponent_color(color)
         
         if color == board.next: # Now opponent's move
@@ -183,10 +403,13 @@ class RlEnv3(RlEnvBase):
             return np.array([1] + [0] * (cls.get_num_feats() * 2 - 1)) , isself # Doomed to lose
 
         elif len(board.legal_actions) == 1: #One choice only
-            return cls.extract_features(board, board.legal_actions[0], oppo, not isself, False)
+            board.play(board.legal_actions[0])
+            feats = cls._extract_successor_features(board, oppo, not isself)
+            board.undo()
+            return feats
         
         elif num_endangered_oppo>1: 
-            return np.array([0] * (cls.get_num_feats() * 2) + [1] + [0] * (cls.get_num_feats() - 1)) , isself # Doomed to win 
+            return np.array([0] * (cls.get_num_feats()) + [1] + [0] * (cls.get_num_feats() - 1)) , isself # Doomed to win 
 
         # Features for groups
         num_groups_2lbt_self, num_groups_2lbt_oppo = get_num_groups_with_k_liberties(board, color, 2)
@@ -212,5 +435,6 @@ class RlEnv3(RlEnvBase):
     
     @classmethod
     def reverse_features(cls, feat):
+        """Swap the self and opponent halves of a feature vector, or of each row of a feature matrix"""
         length=cls.get_num_feats()
-        return np.concatenate((feat[length:], feat[:length]))
+        return np.concatenate((feat[..., length:], feat[..., :length]), axis=-1)
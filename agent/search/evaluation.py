@@ -1,13 +1,20 @@
 from game.go import Board, opponent_color
-from agent.util import get_num_endangered_groups, get_liberties, is_dangerous_liberty, get_num_groups_with_k_liberties
+from agent.util import get_num_endangered_groups, get_dangerous_liberties, get_num_groups_with_k_liberties, \
+    get_num_shared_liberties
 from numpy.random import normal
+from collections import OrderedDict
+import numpy as np
 """
 Evaluation functions for search_agent.
 """
 
 
-def evaluate(board: Board, color):
-    """Color has the next action"""
+def evaluate(board: Board, color, deterministic_noise=False):
+    """
+    Color has the next action
+    :param deterministic_noise: draw the noise from a generator seeded by the position,
+                                so that the same position always gets the same score
+    """
     # Score for win or lose
     score_win = 1000 - board.counter_move  # Prefer faster game
     if board.winner:
@@ -22,33 +29,25 @@ def evaluate(board: Board, color):
         return -(score_win - 10)  # Lose in the next move
 
     # Score for dangerous liberties
-    liberties_self, liberties_oppo = get_liberties(board, color)
-    for liberty in liberties_oppo:
-        if is_dangerous_liberty(board, liberty, oppo):
-            return score_win / 2  # Good probability to win in the next next move
-    for liberty in liberties_self:
-        if is_dangerous_liberty(board, liberty, color):
-            self_groups = board.libertydict.get_groups(color, liberty)
-            liberties = self_groups[0].liberties | self_groups[1].liberties
-            able_to_save = False
-            for lbt in liberties:
-                if len(board.libertydict.get_groups(oppo, lbt)) > 0:
-                    able_to_save = True
-                    break
-            if not able_to_save:
-                return -score_win / 2  # Good probability to lose in the next next move
+    if get_dangerous_liberties(board, oppo):
+        return score_win / 2  # Good probability to win in the next next move
+    for liberty in get_dangerous_liberties(board, color):
+        self_groups = board.libertydict.get_groups(color, liberty)
+        liberties = self_groups[0].liberties | self_groups[1].liberties
+        able_to_save = False
+        for lbt in liberties:
+            if len(board.libertydict.get_groups(oppo, lbt)) > 0:
+                able_to_save = True
+                break
+        if not able_to_save:
+            return -score_win / 2  # Good probability to lose in the next next move
 
     # Score for groups
     num_groups_2lbt_self, num_groups_2lbt_oppo = get_num_groups_with_k_liberties(board, color, 2)
     score_groups = num_groups_2lbt_oppo - num_groups_2lbt_self
 
     # Score for liberties
-    num_shared_liberties_self = 0
-    num_shared_liberties_oppo = 0
-    for liberty in liberties_self:
-        num_shared_liberties_self += len(board.libertydict.get_groups(color, liberty)) - 1
-    for liberty in liberties_oppo:
-        num_shared_liberties_oppo += len(board.libertydict.get_groups(oppo, liberty)) - 1
+    num_shared_liberties_self, num_shared_liberties_oppo = get_num_shared_liberties(board, color)
     score_liberties = num_shared_liberties_oppo - num_shared_liberties_self
 
     # Score for groups (doesn't help)
@@ -66,4 +65,135 @@ def evaluate(board: Board, color):
     # score_groups_oppo += [0, 0]
     # finals = score_groups_oppo[0] - score_groups_self[0] + score_groups_oppo[1] - score_groups_self[1]
 
+    if deterministic_noise:
+        noise = np.random.RandomState((board.situation_hash * 2 + (color == 'BLACK')) % 2 ** 32).normal(1, 0.1, 2)
+        return score_groups * noise[0] + score_liberties * noise[1]
     return score_groups * normal(1, 0.1) + score_liberties * normal(1, 0.1)
+
+
+def evaluate_deterministic(board: Board, color):
+    """evaluate with noise seeded by the position; suitable for EvaluationCache."""
+    return evaluate(board, color, deterministic_noise=True)
+
+
+class EvaluationCache:
+    """
+    Memoize an evaluation function with least-recently-used eviction.
+    Usable wherever an eval_func is expected, e.g. AlphaBetaAgent(color, depth, EvaluationCache()).
+    """
+    def __init__(self, eval_func=evaluate_deterministic, max_size=100000):
+        """
+        :param eval_func: evaluation function to memoize; should be deterministic per position,
+                          otherwise the first noisy score of a position is kept
+        :param max_size: maximum number of cached scores
+        """
+        if max_size < 1:
+            raise ValueError('Cache size must be positive')
+        self.eval_func = eval_func
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, board: Board, color):
+        # The move count and winner are part of the key since the win scores depend on them
+        key = (board.situation_hash, color, board.counter_move, board.winner)
+        score = self.cache.get(key)
+        if score is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return score
+
+        self.misses += 1
+        score = self.eval_func(board, color)
+        self.cache[key] = score
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+        return score
+
+    def clear(self):
+        self.cache.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.
+
+    def __str__(self):
+        return 'EvaluationCache; size: %d/%d; hits: %d; misses: %d; hit rate: %.3f; evictions: %d' % \
+               (len(self.cache), self.max_size, self.hits, self.misses, self.hit_rate, self.evictions)
+
+
+class BatchEvaluator:
+    """
+    Linear evaluation service: queue candidate actions, stack their feature vectors into one matrix
+    and score all of them with a single matrix product.
+    """
+    def __init__(self, feature_func, weights=None, features_all_func=None):
+        """
+        :param feature_func: feature_func(board, action, color) returns the feature vector of the position
+                             after color plays action, seen by color, e.g. RlEnv.extract_features;
+                             so color must be the player to move on board. Functions returning
+                             (feats, isself) like RlEnv2/RlEnv3.extract_features are rejected
+        :param weights: weight vector used when flush() is given none
+        :param features_all_func: optional features_all_func(board, color, actions) returning the feature matrix
+                                  of all actions at once, e.g. RlEnv.extract_features_all; used by
+                                  evaluate_actions instead of one feature_func call per action
+        """
+        self.feature_func = feature_func
+        self.weights = weights
+        self.features_all_func = features_all_func
+        self.queue = []
+        self.num_batches = 0
+        self.num_evaluated = 0
+
+    def put(self, board, action, color):
+        """Queue a candidate; return its index in the scores of the next flush."""
+        feats = self.feature_func(board, action, color)
+        if isinstance(feats, tuple):
+            raise ValueError('feature_func must return a feature vector, not a tuple; '
+                             'sign features returned with isself first, as rl_agentx.ApproxQAgent does')
+        self.queue.append(feats)
+        return len(self.queue) - 1
+
+    def flush(self, weights=None):
+        """Score the queued candidates and empty the queue."""
+        if not self.queue:
+            return np.zeros(0)
+        feats = np.stack(self.queue)
+        self.queue = []
+        return self._score(feats, weights)
+
+    def _score(self, feats, weights=None):
+        self.num_batches += 1
+        self.num_evaluated += len(feats)
+        return feats.dot(self.weights if weights is None else weights)
+
+    def evaluate_actions(self, board, actions, color, weights=None):
+        """Return the scores of color playing each of actions on board; color must be to move."""
+        if self.features_all_func is not None and actions and not self.queue:
+            feats = self.features_all_func(board, color, actions)
+            if isinstance(feats, tuple):
+                raise ValueError('features_all_func must return a feature matrix, not a tuple')
+            return self._score(feats, weights)
+        for action in actions:
+            self.put(board, action, color)
+        return self.flush(weights)
+
+    def evaluate_best(self, board, color, weights=None):
+        """Return the best score of color's legal moves on board (color to move), or None without legal moves."""
+        legal_actions = board.get_legal_actions()
+        if not legal_actions:
+            return None
+        return float(self.evaluate_actions(board, legal_actions, color, weights).max())
+
+    @property
+    def mean_batch_size(self):
+        return self.num_evaluated / self.num_batches if self.num_batches else 0.
+
+    def __str__(self):
+        return 'BatchEvaluator; batches: %d; evaluated: %d; mean batch size: %.1f' % \
+               (self.num_batches, self.num_evaluated, self.mean_batch_size)
@@ -0,0 +1,361 @@
+from agent.basic_agent import Agent
+from game.go import opponent_color
+from concurrent.futures import ProcessPoolExecutor
+import math
+import random
+import time
+"""
+Monte Carlo tree search agent: UCT selection and random or heuristic rollouts.
+Tree moves are played on the given board with play/undo; rollouts are played on a copy.
+"""
+
+ROLLOUT_POLICIES = ('random', 'heuristic')
+PARALLEL_MODES = (None, 'root', 'tree')
+
+
+class Node:
+    __slots__ = ('parent', 'action', 'color', 'hash', 'children', 'untried_actions', 'visits', 'wins')
+
+    def __init__(self, parent, action, color, situation_hash, untried_actions):
+        """
+        :param action: action leading from parent to this node (None to pass)
+        :param color: player who played action; wins are counted for this player
+        :param situation_hash: Board.situation_hash of the node, used to find the node again when reusing the tree
+        :param untried_actions: actions without a child node yet, in random order
+        """
+        self.parent = parent
+        self.action = action
+        self.color = color
+        self.hash = situation_hash
+        self.children = {}  # action -> Node
+        self.untried_actions = untried_actions
+        self.visits = 0
+        self.wins = 0.
+
+    def select_child(self, c_uct):
+        """Return the child maximizing the UCT value."""
+        log_visits = math.log(self.visits)
+        return max(self.children.values(),
+                   key=lambda child: child.wins / child.visits + c_uct * math.sqrt(log_visits / child.visits))
+
+    def __str__(self):
+        return 'Node; action: %s; visits: %d; win rate: %.3f' % \
+               (self.action, self.visits, self.wins / self.visits if self.visits else 0.)
+
+
+def _search_root(board, config, seed):
+    """Worker of the root parallelisation: search with a fresh agent and return its root visit counts."""
+    random.seed(seed)
+    agent = MCTSAgent(**config)
+    root = agent._get_root(board)
+    agent._search(board, root)
+    return agent.playouts, [(child.action, child.visits) for child in root.children.values()]
+
+
+def _rollout_leaves(leaf_boards, config, seed):
+    """Worker of the tree parallelisation: return the rollout winner of each leaf board."""
+    random.seed(seed)
+    agent = MCTSAgent(**config)
+    return [agent._rollout(leaf_board) for leaf_board in leaf_boards]
+
+
+class MCTSAgent(Agent):
+    def __init__(self, color, num_playouts=1000, time_budget=None, c_uct=1.4, rollout_policy='heuristic',
+                 max_rollout_moves=None, scoring_rule='territory', reuse_tree=True, parallel=None, num_workers=None,
+                 batch_size=8, virtual_loss=1, seed=0):
+        """
+        :param num_playouts: playouts per move
+        :param time_budget: seconds per move; if set, play out until the budget runs out instead of num_playouts
+        :param c_uct: exploration constant of UCT
+        :param rollout_policy: 'random' plays random moves except into own eyes;
+                               'heuristic' also captures an opponent group in atari first when it can
+        :param max_rollout_moves: stop a rollout and score the position after this many moves;
+                                  default twice the number of points
+        :param scoring_rule: rule scoring the end of rollouts, see Board.get_score; should be the rule of the match,
+                             territory by default like Board.get_score and HeadlessMatch
+        :param reuse_tree: keep the subtree of the opponent's actual move for the next move
+        :param parallel: None; 'root' grows num_workers independent trees in processes and merges their root visits
+                         (num_playouts is split between them, the tree is not reused);
+                         'tree' evaluates leaves in batches of batch_size, selected with virtual loss,
+                         with the rollouts spread over num_workers processes if num_workers is above 1
+        :param num_workers: number of processes for parallel search
+        :param batch_size: leaves per batch for 'tree' parallelisation
+        :param virtual_loss: lost visits added on the path of a leaf waiting for its evaluation; at least 1
+        :param seed: seed of the worker processes; a fixed seed and num_workers give the same actions
+        """
+        if rollout_policy not in ROLLOUT_POLICIES:
+            raise ValueError('Rollout policy must be one of %s' % (ROLLOUT_POLICIES,))
+        if parallel not in PARALLEL_MODES:
+            raise ValueError('Parallel mode must be one of %s' % (PARALLEL_MODES,))
+        if virtual_loss < 1:
+            # Leaves selected earlier in a batch are only visited through their virtual loss
+            raise ValueError('Virtual loss must be at least 1')
+        super().__init__(color)
+        self.num_playouts = num_playouts
+        self.time_budget = time_budget
+        self.c_uct = c_uct
+        self.rollout_policy = rollout_policy
+        self.max_rollout_moves = max_rollout_moves
+        self.scoring_rule = scoring_rule
+        self.reuse_tree = reuse_tree
+        self.parallel = parallel
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        self.seed = seed
+        self.root = None
+        self._executor = None
+        self._num_batches = 0
+        # Arguments of the agents in the worker processes
+        self._worker_config = {'color': color, 'num_playouts': num_playouts, 'time_budget': time_budget,
+                               'c_uct': c_uct, 'rollout_policy': rollout_policy,
+                               'max_rollout_moves': max_rollout_moves, 'scoring_rule': scoring_rule,
+                               'reuse_tree': False}
+
+        self.playouts = 0  # playouts of the last move
+        self.playouts_per_second = 0.
+        self.total_playouts = 0
+        self.total_time = 0.
+
+    def get_action(self, board):
+        if self.parallel == 'root' and self.num_workers and self.num_workers > 1:
+            return self._get_action_root_parallel(board)
+
+        root = self._get_root(board)
+        time_start = time.time()
+        self._search(board, root)
+        self._update_stats(time.time() - time_start)
+
+        if not root.children:
+            self.root = None
+            return None
+        best_child = max(root.children.values(), key=lambda child: child.visits)
+        self.root = best_child if self.reuse_tree else None
+        return best_child.action
+
+    def _search(self, board, root):
+        """Run playouts from root until num_playouts or the time budget is reached."""
+        deadline = time.time() + self.time_budget if self.time_budget is not None else None
+        self.playouts = 0
+        while (time.time() < deadline) if deadline is not None else (self.playouts < self.num_playouts):
+            if self.parallel == 'tree':
+                self.playouts += self._playout_batch(board, root)
+            else:
+                self._playout(board, root)
+                self.playouts += 1
+
+    def _update_stats(self, time_search):
+        self.playouts_per_second = self.playouts / time_search if time_search > 0 else 0.
+        self.total_playouts += self.playouts
+        self.total_time += time_search
+
+    def _get_action_root_parallel(self, board):
+        """
+        Root parallelisation: every worker grows its own tree from the position with its own seed,
+        then the visit counts of the root actions are summed and the most visited action is played.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        config = dict(self._worker_config, num_playouts=-(-self.num_playouts // self.num_workers))
+        time_start = time.time()
+        futures = [self._executor.submit(_search_root, board, config, hash((self.seed, board.situation_hash, i)))
+                   for i in range(self.num_workers)]
+        visits = {}
+        self.playouts = 0
+        for future in futures:
+            playouts, root_stats = future.result()
+            self.playouts += playouts
+            for action, num_visits in root_stats:
+                visits[action] = visits.get(action, 0) + num_visits
+        self._update_stats(time.time() - time_start)
+
+        self.root = None
+        if not visits:
+            return None
+        return max(visits, key=lambda action: visits[action])
+
+    def _get_root(self, board):
+        """Return the node of the current position from the kept tree, or a new root."""
+        if self.root is not None:
+            candidates = [self.root] + list(self.root.children.values())
+            for node in candidates:
+                if node.hash == board.situation_hash:
+                    node.parent = None
+                    return node
+        return Node(None, None, opponent_color(board.next), board.situation_hash, self._get_tree_actions(board))
+
+    def _playout(self, board, root):
+        """Run selection, expansion, rollout and backpropagation once; the board is restored afterwards."""
+        node, num_moves = self._select(board, root)
+        # Rollout on a copy, which is cheaper than taking back every rollout move
+        winner = self._rollout(board.copy())
+        for _ in range(num_moves):
+            board.undo()
+        self._backpropagate(node, winner)
+
+    def _playout_batch(self, board, root):
+        """
+        Tree parallelisation: select batch_size leaves, each path taking a virtual loss so that the
+        following selections spread over other leaves, then evaluate all leaves at once
+        (in the process pool if num_workers is above 1) and replace the virtual losses by the results.
+        :return: number of playouts
+        """
+        leaves = []
+        leaf_boards = []
+        for _ in range(self.batch_size):
+            node, num_moves = self._select(board, root)
+            self._add_virtual_loss(node, self.virtual_loss)
+            leaves.append(node)
+            leaf_boards.append(board.copy())
+            for _ in range(num_moves):
+                board.undo()
+
+        winners = self._evaluate_leaves(leaf_boards)
+        for node, winner in zip(leaves, winners):
+            self._add_virtual_loss(node, -self.virtual_loss)
+            self._backpropagate(node, winner)
+        return len(leaves)
+
+    def _evaluate_leaves(self, leaf_boards):
+        """Return the rollout winner of each leaf board."""
+        self._num_batches += 1
+        if not self.num_workers or self.num_workers <= 1:
+            return [self._rollout(leaf_board) for leaf_board in leaf_boards]
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        chunk_size = -(-len(leaf_boards) // self.num_workers)
+        futures = [self._executor.submit(_rollout_leaves, leaf_boards[i:i + chunk_size], self._worker_config,
+                                         hash((self.seed, self._num_batches, i)))
+                   for i in range(0, len(leaf_boards), chunk_size)]
+        return [winner for future in futures for winner in future.result()]
+
+    def _select(self, board, root):
+        """
+        Play the tree moves from root by UCT, then expand one child.
+        :return: the reached node and the number of moves played on board
+        """
+        node = root
+        num_moves = 0
+        # Selection
+        while not node.untried_actions and node.children and not self._is_over(board):
+            child = node.select_child(self.c_uct)
+            success, _ = board.play(child.action)
+            if not success:
+                # The kept tree can disagree with the board on ko; drop the child
+                del node.children[child.action]
+                break
+            node = child
+            num_moves += 1
+
+        # Expansion
+        while node.untried_actions and not self._is_over(board):
+            action = node.untried_actions.pop()
+            color = board.next
+            success, _ = board.play(action)
+            if success:
+                child = Node(node, action, color, board.situation_hash, self._get_tree_actions(board))
+                node.children[action] = child
+                node = child
+                num_moves += 1
+                break
+        return node, num_moves
+
+    @staticmethod
+    def _add_virtual_loss(node, virtual_loss):
+        """Count virtual_loss lost visits on the path from node to the root (negative to take them back)."""
+        while node is not None:
+            node.visits += virtual_loss
+            node = node.parent
+
+    @staticmethod
+    def _backpropagate(node, winner):
+        while node is not None:
+            node.visits += 1
+            if node.color == winner:
+                node.wins += 1
+            node = node.parent
+
+    def _rollout(self, board):
+        """Play the rollout policy to the end of the game or max_rollout_moves; return the winner."""
+        max_moves = self.max_rollout_moves or 2 * board.size * board.size
+        empty_points = [point for point in board._neighbors if board.board[point[0]][point[1]] is None]
+        num_moves = 0
+        while not self._is_over(board) and num_moves < max_moves:
+            action = self._get_rollout_action(board, empty_points)
+            if action is None:
+                board.pass_move()
+            else:
+                _, captured_points = board.put_stone(action, check_legal=False)
+                empty_points.extend(captured_points)
+            num_moves += 1
+        return self._get_winner(board)
+
+    def _get_rollout_action(self, board, empty_points):
+        """
+        Pick the rollout action and remove it from empty_points.
+        Empty points are tried in random order until one is legal and not an own eye,
+        which is cheaper than listing all legal actions.
+        """
+        color = board.next
+        if self.rollout_policy == 'heuristic':
+            for group in board.endangered_groups:
+                if group.color != color:
+                    liberty = next(iter(group.liberties))
+                    if board.is_valid_move(liberty):
+                        empty_points.remove(liberty)
+                        return liberty
+
+        num_candidates = len(empty_points)
+        while num_candidates:
+            index = random.randrange(num_candidates)
+            action = empty_points[index]
+            if board.is_valid_move(action) and not self.is_own_eye(board, action, color):
+                empty_points[index] = empty_points[-1]
+                empty_points.pop()
+                return action
+            # Move the rejected point out of the candidate range
+            num_candidates -= 1
+            empty_points[index], empty_points[num_candidates] = empty_points[num_candidates], empty_points[index]
+        return None
+
+    def _get_tree_actions(self, board):
+        """Actions to expand in random order; pass only if there is nothing else."""
+        if self._is_over(board):
+            return []
+        actions = [action for action in board.get_legal_actions() if not self.is_own_eye(board, action, board.next)]
+        if not actions:
+            return [None]
+        random.shuffle(actions)
+        return actions
+
+    @staticmethod
+    def is_own_eye(board, point, color):
+        """Point is surrounded by stones of color only, so filling it cannot help color."""
+        return all(board.board[x][y] == color for x, y in board._neighbors[point])
+
+    @staticmethod
+    def _is_over(board):
+        return board.winner is not None or board.passes >= 2
+
+    def _get_winner(self, board):
+        if board.winner is not None:
+            return board.winner
+        score = board.get_score(self.scoring_rule)
+        return 'BLACK' if score['BLACK'] > score['WHITE'] else 'WHITE'
+
+    def close(self):
+        """Shut down the worker processes of the parallel search."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def get_stats(self):
+        """Return the playout counters used to track engine throughput."""
+        return {'playouts': self.playouts, 'playouts_per_second': self.playouts_per_second,
+                'total_playouts': self.total_playouts, 'total_time': self.total_time,
+                'root_visits': self.root.visits if self.root is not None else 0}
+
+    def __str__(self):
+        return '%s; color: %s; playouts: %d; playouts/s: %.1f' % \
+               (self.__class__.__name__, self.color, self.playouts, self.playouts_per_second)
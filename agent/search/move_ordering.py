@@ -0,0 +1,59 @@
+from agent.util import get_tactical_score
+import random
+"""
+Move ordering for search_agent: tactical moves, killer moves and the history heuristic.
+"""
+
+
+class MoveOrderer:
+    def __init__(self, num_killers=2, seed=None):
+        """
+        :param num_killers: number of killer moves kept per ply
+        :param seed: seed of the random tie-breaking; default drawn from the random module,
+                     so that random.seed makes the search reproducible
+        """
+        self.num_killers = num_killers
+        self.random = random.Random(random.getrandbits(64) if seed is None else seed)
+        self.killers = {}  # ply -> recent moves causing a cutoff at this ply
+        self.history = {}  # (color, move) -> accumulated cutoff weight
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def new_search(self):
+        """Forget killers of the previous search and age the history table."""
+        self.killers = {}
+        self.history = {key: value / 2. for key, value in self.history.items() if value >= 1}
+
+    def order(self, board, actions, ply, first_moves=()):
+        """
+        Sort actions for the player to move: first_moves (PV, stored best move) in the given order,
+        then captures/saves/ataris, then killers of this ply, then by history; ties broken at random.
+        """
+        color = board.next
+        priority = {move: len(first_moves) - i for i, move in enumerate(first_moves) if move is not None}
+        killers = self.killers.get(ply, [])
+        return sorted(actions, key=lambda action: (priority.get(action, 0),
+                                                   get_tactical_score(board, action, color),
+                                                   action in killers,
+                                                   self.history.get((color, action), 0),
+                                                   self.random.random()), reverse=True)
+
+    def record_cutoff(self, color, action, ply, remaining_depth, index):
+        """Record that action (searched index-th) caused a cutoff for color at ply."""
+        self.cutoffs += 1
+        if index == 0:
+            self.first_move_cutoffs += 1
+        killers = self.killers.setdefault(ply, [])
+        if action not in killers:
+            killers.insert(0, action)
+            del killers[self.num_killers:]
+        self.history[(color, action)] = self.history.get((color, action), 0) + remaining_depth * remaining_depth
+
+    @property
+    def first_move_cutoff_rate(self):
+        """Fraction of cutoffs caused by the first searched move; close to 1 means well-ordered."""
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.
+
+    def __str__(self):
+        return 'MoveOrderer; cutoffs: %d; cutoff rate at first move: %.3f' % \
+               (self.cutoffs, self.first_move_cutoff_rate)
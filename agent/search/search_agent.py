@@ -1,132 +1,574 @@
 from agent.basic_agent import Agent
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import random
+import time
 from agent.search.evaluation import evaluate
+from agent.search.transposition import TranspositionTable, EXACT, LOWER, UPPER
+from agent.search.move_ordering import MoveOrderer
+
+
+NULL_WINDOW = 1e-6  # width of the null window; scores are floats
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time budget of the move is exhausted."""
 
 
 class SearchAgent(Agent):
-    def __init__(self, color, depth, eval_func):
+    """Search in place on the given board with play/undo; the board is restored before returning."""
+    def __init__(self, color, depth, eval_func, tt_memory_mb=16, tt_replacement='depth', move_ordering=True,
+                 batch_evaluator=None):
         """
         :param color:
         :param depth: search depth
         :param eval_func: evaluation function from the evaluation module
+        :param tt_memory_mb: memory budget of the transposition table; 0 or None disables it
+        :param tt_replacement: replacement policy of the transposition table, 'depth' or 'always'
+        :param move_ordering: if True, search moves ordered by MoveOrderer and prune by keeping the first ones;
+                              else prune by random sampling
+        :param batch_evaluator: BatchEvaluator valuing each leaf at the horizon, where self is to move,
+                                by the best score of self's legal moves, all scored in one batch;
+                                eval_func is then only used for terminal positions and leaves without moves
         """
         super().__init__(color)
         self.depth = depth
+        self.horizon = depth  # depth of the current search; below depth during iterative deepening
         self.eval_func = eval_func
         self.pruning_actions = None
+        self.transposition_table = TranspositionTable(tt_memory_mb, tt_replacement) if tt_memory_mb else None
+        self.move_orderer = MoveOrderer() if move_ordering else None
+        self.random = random.Random(random.getrandbits(64))  # random pruning without move ordering
+        self.batch_evaluator = batch_evaluator
+        self.deadline = None
+        self.pv = []  # principal variation of the previous iteration
+        self.nodes = 0  # nodes visited by the last search
+        self._root_ply = 0
 
     def get_action(self, board):
         raise NotImplementedError
 
+    def _new_search(self, board):
+        """Reset the per-move search state before searching from board."""
+        self._root_ply = len(board.undo_stack)
+        self.nodes = 0
+        if self.transposition_table is not None:
+            self.transposition_table.new_search()
+        if self.move_orderer is not None:
+            self.move_orderer.new_search()
+
+    def _get_ply(self, board):
+        return len(board.undo_stack) - self._root_ply
+
+    def _get_actions(self, board, *first_moves):
+        """
+        Return the (pruned) legal actions to search, with first_moves (PV or stored best moves) in front.
+        First moves that are not legal here are dropped: the position hash leaves out the ko point,
+        so a stored move can be a ko retake.
+        """
+        legal_actions = board.get_legal_actions()
+        first_moves = [move for move in first_moves if move in legal_actions]
+        if self.move_orderer is not None:
+            legal_actions = self.move_orderer.order(board, legal_actions, self._get_ply(board), first_moves)
+            return legal_actions[:self.pruning_actions] if self.pruning_actions else legal_actions
+
+        if self.pruning_actions and len(legal_actions) > self.pruning_actions:
+            legal_actions = self.random.sample(legal_actions, self.pruning_actions)
+        for move in reversed(first_moves):
+            if move in legal_actions:
+                legal_actions.remove(move)
+            legal_actions.insert(0, move)
+        return legal_actions
+
+    def _seed(self, seed):
+        """Seed the random pruning and the tie-breaking of move ordering."""
+        self.random.seed(seed)
+        if self.move_orderer is not None:
+            self.move_orderer.random.seed(seed)
+
+    def _get_pv_move(self, board):
+        """Return the move of the previous principal variation at this node, if the node lies on it."""
+        ply = self._get_ply(board)
+        if ply >= len(self.pv):
+            return None
+        for i in range(ply):
+            if board.undo_stack[self._root_ply + i][0] != self.pv[i]:
+                return None
+        return self.pv[ply]
+
+    def _evaluate_leaf(self, board):
+        """Score a position at the horizon for self.color."""
+        if self.batch_evaluator is not None and board.next == self.color and not self.terminal_test(board):
+            # The moves are self's own, so the features are taken from the mover's view as they expect
+            score = self.batch_evaluator.evaluate_best(board, self.color)
+            if score is not None:
+                return score
+        return self.eval_func(board, self.color)
+
+    def _check_time(self):
+        if self.deadline is not None and time.time() > self.deadline:
+            raise SearchTimeout()
+
+    def _probe(self, board, remaining, alpha, beta):
+        """
+        Look up the transposition table.
+        :param remaining: depth still to search below this node
+        :return: score if the stored entry settles this node (else None), the narrowed alpha and beta,
+                 and the stored best move
+        """
+        if self.transposition_table is None:
+            return None, alpha, beta, None
+        entry = self.transposition_table.lookup(board.situation_hash)
+        if entry is None:
+            return None, alpha, beta, None
+        entry_depth, score, flag, best_move = entry
+        if entry_depth >= remaining:
+            if flag == EXACT:
+                return score, alpha, beta, best_move
+            elif flag == LOWER:
+                alpha = max(alpha, score)
+            else:
+                beta = min(beta, score)
+            if alpha >= beta:
+                return score, alpha, beta, best_move
+        return None, alpha, beta, best_move
+
+    def _record_cutoff(self, board, remaining, action, index):
+        if self.move_orderer is not None:
+            self.move_orderer.record_cutoff(board.next, action, self._get_ply(board), remaining, index)
+
+    def _store(self, board, remaining, score, alpha, beta, best_move):
+        """Store a search result; alpha and beta are the bounds the node was searched with."""
+        if self.transposition_table is None:
+            return
+        if score <= alpha:
+            flag = UPPER
+        elif score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.transposition_table.store(board.situation_hash, remaining, score, flag, best_move)
+
     def __str__(self):
         return '%s; color: %s; search_depth: %d' % (self.__class__.__name__, self.color, self.depth)
 
 
+def _search_root_move(board, action, config, pruning_actions, horizon, alpha, pv, deadline, seed):
+    """
+    Worker of the parallel root search: search the reply to one root action with a fresh agent.
+    :return: score and the actions from action on, or None if the deadline passed
+    """
+    # Seed every source of randomness, including the noise of evaluate, as each worker process
+    # searches whichever root actions it is handed
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    agent = AlphaBetaAgent(**config)
+    agent._seed(seed)
+    agent.pruning_actions = pruning_actions
+    agent._new_search(board)
+    agent.horizon = horizon
+    agent.pv = pv if pv and pv[0] == action else []
+    agent.deadline = deadline
+    board.play(action)
+    try:
+        score, actions = agent.min_value(board, 0, alpha, float("inf"))
+    except SearchTimeout:
+        return None
+    return score, [action] + actions
+
+
 class AlphaBetaAgent(SearchAgent):
-    def __init__(self, color, depth, eval_func=evaluate):
-        super().__init__(color, depth, eval_func)
+    def __init__(self, color, depth, eval_func=evaluate, tt_memory_mb=16, tt_replacement='depth', time_budget=None,
+                 move_ordering=True, num_workers=None, seed=0, batch_evaluator=None):
+        """
+        :param time_budget: seconds per move; if set, search depth 1, 2, ... up to depth by iterative deepening
+                            and answer with the deepest completed search when the budget runs out
+        :param num_workers: if above 1, split the root actions across this many processes (e.g. os.cpu_count())
+        :param seed: seed of the parallel root search; the same seed and num_workers give the same actions
+        """
+        super().__init__(color, depth, eval_func, tt_memory_mb, tt_replacement, move_ordering, batch_evaluator)
+        self.time_budget = time_budget
+        self.completed_depth = 0
+        self.num_workers = num_workers
+        self.seed = seed
+        self._executor = None
+        # Arguments of the fresh agent each worker searches with
+        self._worker_config = {'color': color, 'depth': depth, 'eval_func': eval_func, 'tt_memory_mb': tt_memory_mb,
+                               'tt_replacement': tt_replacement, 'move_ordering': move_ordering,
+                               'batch_evaluator': batch_evaluator}
 
     def get_action(self, board, pruning_actions=20):
 
         self.pruning_actions = pruning_actions
-        score, actions = self.max_value(board, 0, float("-inf"), float("inf"))
+        self._new_search(board)
+        if self.time_budget is not None:
+            return self._iterative_deepening(board)
+
+        self.horizon = self.depth
+        score, actions = self._search_root(board)
 
         return actions[0] if len(actions) > 0 else None
 
+    def _search_root(self, board):
+        """Search the root to the current horizon, in parallel if num_workers is above 1."""
+        if self.num_workers is None or self.num_workers <= 1 or self.terminal_test(board):
+            return self.max_value(board, 0, float("-inf"), float("inf"))
+        return self._parallel_root(board)
+
+    def _parallel_root(self, board):
+        """
+        Split the root actions across the worker processes.
+        The first action is searched alone to get a bound, then the rest in batches of num_workers;
+        alpha is raised between batches only, so the result does not depend on the timing of the workers.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        self._seed(hash((self.seed, board.situation_hash, self.horizon)))
+        legal_actions = self._get_actions(board, self._get_pv_move(board))
+        if not legal_actions:
+            return self.eval_func(board, self.color), []
+        batches = [legal_actions[:1]] + [legal_actions[i:i + self.num_workers]
+                                         for i in range(1, len(legal_actions), self.num_workers)]
+
+        alpha = float("-inf")
+        max_score = float("-inf")
+        max_score_actions = None
+        index = 0
+        for batch in batches:
+            futures = []
+            for action in batch:
+                seed = hash((self.seed, board.situation_hash, self.horizon, index))
+                futures.append(self._executor.submit(_search_root_move, board, action, self._worker_config,
+                                                     self.pruning_actions, self.horizon, alpha, self.pv,
+                                                     self.deadline, seed))
+                index += 1
+            for future in futures:
+                result = future.result()
+                if result is None:
+                    raise SearchTimeout()
+                score, actions = result
+                if score > max_score:
+                    max_score = score
+                    max_score_actions = actions
+            alpha = max(alpha, max_score)
+
+        self._store(board, self.horizon, max_score, float("-inf"), float("inf"), max_score_actions[0])
+        return max_score, max_score_actions
+
+    def close(self):
+        """Shut down the worker processes of the parallel root search."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _iterative_deepening(self, board):
+        """Return the best action of the deepest search completed within the time budget."""
+        self.deadline = time.time() + self.time_budget
+        self.pv = []
+        self.completed_depth = 0
+        best_action = None
+        try:
+            for horizon in range(1, self.depth + 1):
+                self.horizon = horizon
+                score, actions = self._search_root(board)
+                if actions:
+                    self.pv = actions
+                    best_action = actions[0]
+                self.completed_depth = horizon
+        except SearchTimeout:
+            # Take back the moves of the interrupted search
+            while len(board.undo_stack) > self._root_ply:
+                board.undo()
+        finally:
+            self.deadline = None
+            self.pv = []
+
+        if best_action is None:
+            legal_actions = board.get_legal_actions()
+            best_action = random.choice(legal_actions) if legal_actions else None
+        return best_action
+
     def max_value(self, board, depth, alpha, beta):
         """Return the highest score and the corresponding subsequent actions"""
-        if self.terminal_test(board) or depth == self.depth:
-            return self.eval_func(board, self.color), []
+        self._check_time()
+        self.nodes += 1
+        if self.terminal_test(board) or depth == self.horizon:
+            return self._evaluate_leaf(board), []
+
+        alpha_orig, beta_orig = alpha, beta
+        score, alpha, beta, best_move = self._probe(board, self.horizon - depth, alpha, beta)
+        if score is not None:
+            return score, [best_move] if best_move is not None else []
 
         max_score = float("-inf")
         max_score_actions = None
         # Prune the legal actions
-        legal_actions = board.get_legal_actions()
-        if self.pruning_actions and len(legal_actions) > self.pruning_actions:
-            legal_actions = random.sample(legal_actions, self.pruning_actions)
+        legal_actions = self._get_actions(board, self._get_pv_move(board), best_move)
+        if not legal_actions:
+            return self.eval_func(board, self.color), []
 
-        for action in legal_actions:
-            score, actions = self.min_value(board.generate_successor_state(action), depth, alpha, beta)
+        for index, action in enumerate(legal_actions):
+            success, _ = board.play(action)
+            if not success:
+                continue
+            score, actions = self.min_value(board, depth, alpha, beta)
+            board.undo()
             if score > max_score:
                 max_score = score
                 max_score_actions = [action] + actions
 
             if max_score > beta:
-                return max_score, max_score_actions
+                self._record_cutoff(board, self.horizon - depth, action, index)
+                break
 
             if max_score > alpha:
                 alpha = max_score
 
+        if max_score_actions is None:
+            return self.eval_func(board, self.color), []
+        self._store(board, self.horizon - depth, max_score, alpha_orig, beta_orig, max_score_actions[0])
         return max_score, max_score_actions
 
     def min_value(self, board, depth, alpha, beta):
         """Return the lowest score and the corresponding subsequent actions"""
-        if self.terminal_test(board) or depth == self.depth:
+        self._check_time()
+        self.nodes += 1
+        if self.terminal_test(board) or depth == self.horizon:
             return self.eval_func(board, self.color), []
 
+        alpha_orig, beta_orig = alpha, beta
+        score, alpha, beta, best_move = self._probe(board, self.horizon - depth, alpha, beta)
+        if score is not None:
+            return score, [best_move] if best_move is not None else []
+
         min_score = float("inf")
         min_score_actions = None
         # Prune the legal actions
-        legal_actions = board.get_legal_actions()
-        if self.pruning_actions and len(legal_actions) > self.pruning_actions:
-            legal_actions = random.sample(legal_actions, self.pruning_actions)
+        legal_actions = self._get_actions(board, self._get_pv_move(board), best_move)
+        if not legal_actions:
+            return self.eval_func(board, self.color), []
 
-        for action in legal_actions:
-            score, actions = self.max_value(board.generate_successor_state(action), depth+1, alpha, beta)
+        for index, action in enumerate(legal_actions):
+            success, _ = board.play(action)
+            if not success:
+                continue
+            score, actions = self.max_value(board, depth+1, alpha, beta)
+            board.undo()
             if score < min_score:
                 min_score = score
                 min_score_actions = [action] + actions
 
             if min_score < alpha:
-                return min_score, min_score_actions
+                self._record_cutoff(board, self.horizon - depth, action, index)
+                break
 
             if min_score < beta:
                 beta = min_score
 
+        if min_score_actions is None:
+            return self.eval_func(board, self.color), []
+        self._store(board, self.horizon - depth, min_score, alpha_orig, beta_orig, min_score_actions[0])
         return min_score, min_score_actions
 
 
 class ExpectimaxAgent(SearchAgent):
     """Assume uniform distribution for opponent"""
-    def __init__(self, color, depth, eval_func=evaluate):
-        super().__init__(color, depth, eval_func)
+    def __init__(self, color, depth, eval_func=evaluate, tt_memory_mb=16, tt_replacement='depth', move_ordering=False,
+                 batch_evaluator=None):
+        """
+        :param move_ordering: off by default: without cutoffs ordering saves nothing, and pruning to the first
+                              ordered replies would bias the uniform opponent towards tactical moves
+        """
+        super().__init__(color, depth, eval_func, tt_memory_mb, tt_replacement, move_ordering, batch_evaluator)
 
     def get_action(self, board, pruning_actions=16):
         self.pruning_actions = pruning_actions
+        self._new_search(board)
+        self.horizon = self.depth
         score, actions = self.max_value(board, 0)
         return actions[0] if len(actions) > 0 else None
 
     def max_value(self, board, depth):
-        if self.terminal_test(board) or depth == self.depth:
-            return self.eval_func(board, self.color), []
+        if self.terminal_test(board) or depth == self.horizon:
+            return self._evaluate_leaf(board), []
+
+        score, _, _, best_move = self._probe(board, self.horizon - depth, float("-inf"), float("inf"))
+        if score is not None:
+            return score, [best_move] if best_move is not None else []
 
         max_score = float("-inf")
         max_score_actions = None
         # Prune the legal actions
-        legal_actions = board.get_legal_actions()
-        if self.pruning_actions and len(legal_actions) > self.pruning_actions:
-            legal_actions = random.sample(legal_actions, self.pruning_actions)
+        legal_actions = self._get_actions(board, best_move)
+        if not legal_actions:
+            return self.eval_func(board, self.color), []
 
         for action in legal_actions:
-            score, actions = self.expected_value(board.generate_successor_state(action), depth)
+            success, _ = board.play(action)
+            if not success:
+                continue
+            score, actions = self.expected_value(board, depth)
+            board.undo()
             if score > max_score:
                 max_score = score
                 max_score_actions = [action] + actions
 
+        if max_score_actions is None:
+            return self.eval_func(board, self.color), []
+        self._store(board, self.horizon - depth, max_score, float("-inf"), float("inf"), max_score_actions[0])
         return max_score, max_score_actions
 
     def expected_value(self, board, depth):
-        if self.terminal_test(board) or depth == self.depth:
+        if self.terminal_test(board) or depth == self.horizon:
             return self.eval_func(board, self.color), []
 
-        expected_score = 0.0
-        # Prune the legal actions
-        legal_actions = board.get_legal_actions()
-        if self.pruning_actions and len(legal_actions) > self.pruning_actions:
-            legal_actions = random.sample(legal_actions, self.pruning_actions)
+        score, _, _, _ = self._probe(board, self.horizon - depth, float("-inf"), float("inf"))
+        if score is not None:
+            return score, []
 
+        # Prune the legal actions
+        legal_actions = self._get_actions(board)
+        scores = []
         for action in legal_actions:
-            score, actions = self.max_value(board.generate_successor_state(action), depth+1)
-            expected_score += score / len(legal_actions)
+            success, _ = board.play(action)
+            if not success:
+                continue
+            score, actions = self.max_value(board, depth+1)
+            board.undo()
+            scores.append(score)
+        if not scores:
+            return self.eval_func(board, self.color), []
 
+        expected_score = sum(score / len(scores) for score in scores)
+        self._store(board, self.horizon - depth, expected_score, float("-inf"), float("inf"), None)
         return expected_score, []
+
+
+class PVSAgent(SearchAgent):
+    """
+    Principal variation search (negascout) in negamax form, deepened iteratively with aspiration windows.
+    Depth counts moves of both players, as for AlphaBetaAgent; the principal variation is kept
+    in a triangular table instead of returning action lists from every node.
+    """
+    def __init__(self, color, depth, eval_func=evaluate, tt_memory_mb=16, tt_replacement='depth', time_budget=None,
+                 move_ordering=True, aspiration_window=4.):
+        """
+        :param time_budget: seconds per move; if None, always search to depth
+        :param aspiration_window: half width of the window around the score of the previous iteration;
+                                  the failing side is opened to infinity and searched again
+        """
+        super().__init__(color, depth, eval_func, tt_memory_mb, tt_replacement, move_ordering)
+        self.time_budget = time_budget
+        self.aspiration_window = aspiration_window
+        self.completed_depth = 0
+        self.researches = 0  # searches repeated after failing the aspiration window
+        self.pv_table = []
+        self.pv_length = []
+
+    def get_action(self, board, pruning_actions=20):
+        self.pruning_actions = pruning_actions
+        self._new_search(board)
+        self.deadline = time.time() + self.time_budget if self.time_budget is not None else None
+        self.pv = []
+        self.completed_depth = 0
+        self.researches = 0
+        max_ply = 2 * self.depth + 1
+        self.pv_table = [[None] * max_ply for _ in range(max_ply)]
+        self.pv_length = [0] * max_ply
+
+        best_action = None
+        score = None
+        try:
+            for horizon in range(1, self.depth + 1):
+                self.horizon = horizon
+                score = self._aspiration_search(board, 2 * horizon, score)
+                if self.pv_length[0] > 0:
+                    self.pv = self.pv_table[0][:self.pv_length[0]]
+                    best_action = self.pv[0]
+                self.completed_depth = horizon
+        except SearchTimeout:
+            # Take back the moves of the interrupted search
+            while len(board.undo_stack) > self._root_ply:
+                board.undo()
+        finally:
+            self.deadline = None
+            self.pv = []
+
+        if best_action is None:
+            legal_actions = board.get_legal_actions()
+            best_action = random.choice(legal_actions) if legal_actions else None
+        return best_action
+
+    def _aspiration_search(self, board, num_plies, guess):
+        """Search the root within a window around guess, opening the failing side until the score lies inside."""
+        if guess is None or abs(guess) == float("inf"):
+            return self.pvs(board, 0, num_plies, float("-inf"), float("inf"))
+        alpha, beta = guess - self.aspiration_window, guess + self.aspiration_window
+        while True:
+            score = self.pvs(board, 0, num_plies, alpha, beta)
+            if score <= alpha:
+                alpha = float("-inf")
+            elif score >= beta:
+                beta = float("inf")
+            else:
+                return score
+            self.researches += 1
+
+    def pvs(self, board, ply, remaining, alpha, beta):
+        """Return the score for the player to move, searching remaining plies; the line is left in pv_table[ply]."""
+        self._check_time()
+        self.nodes += 1
+        self.pv_length[ply] = ply
+        sign = 1 if board.next == self.color else -1
+        if self.terminal_test(board) or remaining == 0:
+            return sign * self.eval_func(board, self.color)
+
+        alpha_orig, beta_orig = alpha, beta
+        score, alpha, beta, best_move = self._probe(board, remaining, alpha, beta)
+        if ply == 0:
+            alpha, beta = alpha_orig, beta_orig  # The root always searches for a move
+        elif score is not None:
+            return score
+
+        legal_actions = self._get_actions(board, self._get_pv_move(board), best_move)
+        if not legal_actions:
+            return sign * self.eval_func(board, self.color)
+
+        best_score = float("-inf")
+        best_action = None
+        for index, action in enumerate(legal_actions):
+            success, _ = board.play(action)
+            if not success:
+                continue
+            if best_action is None:
+                score = -self.pvs(board, ply + 1, remaining - 1, -beta, -alpha)
+            else:
+                # Prove that action is no better than the best so far with a null window
+                score = -self.pvs(board, ply + 1, remaining - 1, -alpha - NULL_WINDOW, -alpha)
+                if alpha < score < beta:
+                    score = -self.pvs(board, ply + 1, remaining - 1, -beta, -score)
+            board.undo()
+
+            if score > best_score:
+                best_score = score
+                best_action = action
+                if score > alpha:
+                    alpha = score
+                    self._update_pv(ply, action)
+            if alpha >= beta:
+                self._record_cutoff(board, remaining, action, index)
+                break
+
+        if best_action is None:
+            return sign * self.eval_func(board, self.color)
+        self._store(board, remaining, best_score, alpha_orig, beta_orig, best_action)
+        return best_score
+
+    def _update_pv(self, ply, action):
+        """Set the line at ply to action followed by the line found at ply + 1."""
+        line = self.pv_table[ply]
+        child_line = self.pv_table[ply + 1]
+        line[ply] = action
+        for i in range(ply + 1, self.pv_length[ply + 1]):
+            line[i] = child_line[i]
+        self.pv_length[ply] = max(self.pv_length[ply + 1], ply + 1)
@@ -0,0 +1,73 @@
+"""
+Transposition table for search_agent, keyed by Board.situation_hash.
+"""
+
+EXACT = 0
+LOWER = 1  # score is a lower bound (fail-high)
+UPPER = 2  # score is an upper bound (fail-low)
+
+REPLACEMENT_POLICIES = ('depth', 'always')
+ENTRY_BYTES = 160  # approximate memory of one slot: key, tuple and its items
+
+
+class TranspositionTable:
+    def __init__(self, memory_mb=16, replacement='depth'):
+        """
+        Fixed-size table of slots indexed by hash; each slot holds one entry.
+        :param memory_mb: memory budget, which fixes the number of slots
+        :param replacement: 'depth' keeps the deeper entry of the current search when two positions
+                            share a slot (entries from older searches are always replaced); 'always' keeps the newest
+        """
+        if replacement not in REPLACEMENT_POLICIES:
+            raise ValueError('Replacement policy must be one of %s' % (REPLACEMENT_POLICIES,))
+        self.num_slots = max(1, int(memory_mb * 2 ** 20) // ENTRY_BYTES)
+        self.replacement = replacement
+        self.slots = [None] * self.num_slots  # (key, depth, score, flag, best_move, generation)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        """Age the stored entries; called once per root search."""
+        self.generation += 1
+
+    def lookup(self, key):
+        """Return (depth, score, flag, best_move) stored for key, or None."""
+        entry = self.slots[key % self.num_slots]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1:5]
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, score, flag, best_move):
+        index = key % self.num_slots
+        entry = self.slots[index]
+        if entry is not None:
+            if self.replacement == 'depth' and entry[0] != key and entry[5] == self.generation and entry[1] > depth:
+                return
+            if entry[0] != key:
+                self.overwrites += 1
+        self.slots[index] = (key, depth, score, flag, best_move, self.generation)
+        self.stores += 1
+
+    def clear(self):
+        self.slots = [None] * self.num_slots
+        self.hits = self.misses = self.stores = self.overwrites = 0
+
+    @property
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.
+
+    def get_stats(self):
+        """Return the counters used to size the table."""
+        return {'slots': self.num_slots, 'used': sum(1 for entry in self.slots if entry is not None),
+                'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate,
+                'stores': self.stores, 'overwrites': self.overwrites}
+
+    def __str__(self):
+        return 'TranspositionTable; slots: %d; hits: %d; misses: %d; hit rate: %.3f; overwrites: %d' % \
+               (self.num_slots, self.hits, self.misses, self.hit_rate, self.overwrites)
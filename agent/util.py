@@ -1,28 +1,25 @@
-from game.go import Board, opponent_color, Group
+from game.go import Board, opponent_color, Group, COLOR_CODES, label_regions
 import numpy as np
 
 
 def get_num_endangered_groups(board: Board, color):
-    num_endangered_self = 0
-    num_endangered_oppo = 0
-    for group in board.endangered_groups:
-        if group.color == color:
-            num_endangered_self += 1
-        else:
-            num_endangered_oppo += 1
-    return num_endangered_self, num_endangered_oppo
+    return get_num_groups_with_k_liberties(board, color, 1)
 
 
 def get_num_groups_with_k_liberties(board: Board, color, k):
-    num_groups_self = 0
-    num_groups_oppo = 0
-    for group in board.groups[color]:
-        if group.num_liberty == k:
-            num_groups_self += 1
-    for group in board.groups[opponent_color(color)]:
-        if group.num_liberty == k:
-            num_groups_oppo += 1
-    return num_groups_self, num_groups_oppo
+    return board.get_num_groups_with_liberties(color, k), \
+           board.get_num_groups_with_liberties(opponent_color(color), k)
+
+
+def get_num_shared_liberties(board: Board, color):
+    """For self and opponent: sum over liberties of the number of groups sharing it minus one."""
+    return board.get_num_shared_liberties(color), board.get_num_shared_liberties(opponent_color(color))
+
+
+def get_dangerous_liberties(board: Board, color):
+    """Liberties shared by exactly two groups of color with two liberties each (see is_dangerous_liberty)."""
+    return {liberty for group in board.liberty_groups[color].get(2, ()) for liberty in group.liberties
+            if is_dangerous_liberty(board, liberty, color)}
 
 
 def get_liberties(board: Board, color):
@@ -35,6 +32,23 @@ def get_liberties(board: Board, color):
     return liberties_self, liberties_oppo
 
 
+def get_tactical_score(board: Board, point, color):
+    """
+    Score the urgency of color playing point from the liberty data:
+    capturing stones first, then saving endangered self groups, then putting opponent groups in atari.
+    """
+    score = 0
+    for group in board.libertydict.get_groups(opponent_color(color), point):
+        if group.num_liberty == 1:
+            score += 100 * len(group.points)
+        elif group.num_liberty == 2:
+            score += 10
+    for group in board.libertydict.get_groups(color, point):
+        if group.num_liberty == 1:
+            score += 50 * len(group.points)
+    return score
+
+
 def is_dangerous_liberty(board: Board, point, color):
     self_groups = board.libertydict.get_groups(color, point)
     return len(self_groups) == 2 and self_groups[0].num_liberty == 2 and self_groups[1].num_liberty == 2
@@ -112,3 +126,81 @@ def get_liberty_score(board: Board, color):
     scores.sort(reverse=True)
     scores.extend([0, 0])
     return scores[:2] + [-share3 / 2.]
+
+
+def stack_boards(boards):
+    """Stack boards of the same size, or their to_array() grids, into an N x S x S int8 array of color codes."""
+    return np.stack([board if isinstance(board, np.ndarray) else board.to_array() for board in boards])
+
+
+def _neighbor_labels(labels):
+    """Return the labels of the 4 neighbors of every point, -1 beyond the edge; shape (4, ...)."""
+    shifted = np.full((4,) + labels.shape, -1, dtype=labels.dtype)
+    shifted[0, ..., 1:, :] = labels[..., :-1, :]
+    shifted[1, ..., :-1, :] = labels[..., 1:, :]
+    shifted[2, ..., :, 1:] = labels[..., :, :-1]
+    shifted[3, ..., :, :-1] = labels[..., :, 1:]
+    return shifted
+
+
+def get_batch_group_features(boards, color):
+    """
+    Compute group and liberty features for a stack of positions at once.
+    :param boards: N x S x S int8 array of color codes, e.g. from stack_boards
+    :param color: the color whose groups are examined
+    :return: dict of length-N arrays: num_groups, num_liberties (distinct liberty points),
+             num_groups_2lbt, num_endangered (groups with one liberty), exist_endangered,
+             num_shared_liberties (sum over liberties of the number of sharing groups - 1),
+             num_dangerous_liberties (liberties shared by exactly two groups with two liberties each)
+             and liberty_var_mean (mean over groups of calc_group_liberty_var, nan without groups)
+    """
+    num_boards = boards.shape[0]
+    num_points = boards[0].size
+    stones = boards == COLOR_CODES[color]
+    labels = label_regions(stones)
+    board_index = np.arange(boards.size) // num_points
+
+    # Each group is labelled by the flat index of its first point; groups are numbered in the order of their roots
+    roots = np.flatnonzero(labels.ravel() == np.arange(boards.size))
+    group_boards = board_index[roots]
+    num_groups = np.bincount(group_boards, minlength=num_boards)
+
+    # Distinct (liberty point, group) pairs, via the groups adjacent to each empty point;
+    # a neighbor counts only if none of the previous neighbors of the point is in its group
+    neighbor_labels = _neighbor_labels(labels)
+    is_pair = (boards == 0) & (neighbor_labels >= 0)
+    for k in range(1, 4):
+        is_pair[k] &= (neighbor_labels[k] != neighbor_labels[:k]).all(axis=0)
+    pair_points = np.broadcast_to(np.arange(boards.size).reshape(boards.shape), is_pair.shape)[is_pair]
+    pair_groups = np.searchsorted(roots, neighbor_labels[is_pair])
+
+    group_liberties = np.bincount(pair_groups, minlength=len(roots))
+    point_groups = np.bincount(pair_points, minlength=boards.size)
+    liberty_points = np.flatnonzero(point_groups)
+
+    # Dangerous liberties: shared by exactly two groups, both with two liberties
+    two_liberty_pairs = np.bincount(pair_points[group_liberties[pair_groups] == 2], minlength=boards.size)
+    dangerous = liberty_points[(point_groups[liberty_points] == 2) & (two_liberty_pairs[liberty_points] == 2)]
+
+    # Liberty variance of each group, as calc_group_liberty_var: variance of the x plus that of the y coordinates
+    group_var = np.zeros(len(roots))
+    num_pairs = np.maximum(group_liberties, 1)
+    for coords in np.divmod(pair_points % num_points, boards.shape[-1]):
+        coord_mean = np.bincount(pair_groups, weights=coords, minlength=len(roots)) / num_pairs
+        deviations = coords - coord_mean[pair_groups]
+        group_var += np.bincount(pair_groups, weights=deviations * deviations, minlength=len(roots)) / num_pairs
+    with np.errstate(invalid='ignore', divide='ignore'):
+        liberty_var_mean = np.bincount(group_boards, weights=group_var, minlength=num_boards) / num_groups
+
+    num_endangered = np.bincount(group_boards[group_liberties == 1], minlength=num_boards)
+    return {
+        'num_groups': num_groups,
+        'num_liberties': np.bincount(board_index[liberty_points], minlength=num_boards),
+        'num_groups_2lbt': np.bincount(group_boards[group_liberties == 2], minlength=num_boards),
+        'num_endangered': num_endangered,
+        'exist_endangered': num_endangered > 0,
+        'num_shared_liberties': np.bincount(board_index[liberty_points], weights=point_groups[liberty_points] - 1,
+                                            minlength=num_boards).astype(int),
+        'num_dangerous_liberties': np.bincount(board_index[dangerous], minlength=num_boards),
+        'liberty_var_mean': liberty_var_mean,
+    }
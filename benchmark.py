@@ -1,16 +1,30 @@
-from match import Match
+from game.engine import HeadlessMatch
+from game.go import Board
 from agent.basic_agent import RandomAgent, GreedyAgent
-from agent.search.search_agent import AlphaBetaAgent, ExpectimaxAgent
+from agent.search.search_agent import AlphaBetaAgent, ExpectimaxAgent, PVSAgent
+from agent.search.mcts_agent import MCTSAgent
+from agent.search.evaluation import BatchEvaluator
 from agent.rl.rl_agent import ApproxQAgent
 from agent.rl.rl_env import RlEnv
 from statistics import mean
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+import numpy as np
+import math
+import os
+import pickle
+import random
+import time
 
 
 class Benchmark:
-    def __init__(self, agent_self, agent_oppo):
+    def __init__(self, agent_self, agent_oppo, board_size=19, turn_time=None, max_moves=None):
         """
         :param agent_self: the agent to evaluate
         :param agent_oppo: the opponent agent, such as RandomAgent, GreedyAgent
+        :param board_size: 9, 13 or 19
+        :param turn_time: seconds allowed per move, see HeadlessMatch
+        :param max_moves: stop and score each game after this many stones
         """
         if (agent_self.color == 'BLACK' and agent_oppo.color == 'WHITE') \
                 or (agent_self.color == 'WHITE' and agent_oppo.color == 'BLACK'):
@@ -18,21 +32,23 @@ class Benchmark:
             self.agent_oppo = agent_oppo
         else:
             raise ValueError('Must have one BLACK agent and one WHITE agent!')
+        self.board_size = board_size
+        self.turn_time = turn_time
+        self.max_moves = max_moves
 
-    def create_match(self, gui=False):
-        if self.agent_self.color == 'BLACK':
-            return Match(agent_black=self.agent_self, agent_white=self.agent_oppo, gui=gui)
-        else:
-            return Match(agent_white=self.agent_self, agent_black=self.agent_oppo, gui=gui)
+    def create_match(self):
+        agents = {self.agent_self.color: self.agent_self, self.agent_oppo.color: self.agent_oppo}
+        return HeadlessMatch(agent_black=agents['BLACK'], agent_white=agents['WHITE'], board_size=self.board_size,
+                             turn_time=self.turn_time, max_moves=self.max_moves)
 
-    def run_benchmark(self, num_tests, gui=False):
+    def run_benchmark(self, num_tests):
         list_win = []
         list_num_moves = []
         list_time_elapsed = []
 
         for i in range(num_tests):
             print('Running game %d: ' % i, end='')
-            match = self.create_match(gui=gui)
+            match = self.create_match()
             match.start()
 
             list_win.append(match.winner == self.agent_self.color)
@@ -46,6 +62,250 @@ class Benchmark:
         return win_mean, num_moves_mean, time_elapsed_mean
 
 
+def create_agent(name, color, depth=1, time_budget=None, num_workers=None, num_playouts=1000, path_weights=None):
+    """
+    Create an agent by name.
+    :param name: random; greedy; minimax; pvs; expectimax; mcts; approx-q
+    :param depth: search depth for minimax, pvs and expectimax (maximum depth if there is a time budget)
+    :param time_budget: seconds per move for minimax and pvs, searched by iterative deepening, or for mcts
+    :param num_workers: processes of the parallel root search for minimax and mcts
+    :param num_playouts: playouts per move for mcts without a time budget
+    :param path_weights: weight file for approx-q; for minimax and expectimax, leaves are then valued
+                         by the best Q value of these RlEnv weights, scored in batches
+    """
+    if name == 'random':
+        return RandomAgent(color)
+    elif name == 'greedy':
+        return GreedyAgent(color)
+    elif name == 'minimax':
+        return AlphaBetaAgent(color, depth, time_budget=time_budget, num_workers=num_workers,
+                              batch_evaluator=_create_batch_evaluator(color, path_weights))
+    elif name == 'pvs':
+        return PVSAgent(color, depth, time_budget=time_budget)
+    elif name == 'expectimax':
+        return ExpectimaxAgent(color, depth, batch_evaluator=_create_batch_evaluator(color, path_weights))
+    elif name == 'mcts':
+        return MCTSAgent(color, num_playouts, time_budget=time_budget, parallel='root' if num_workers else None,
+                         num_workers=num_workers)
+    elif name == 'approx-q':
+        agent = ApproxQAgent(color, RlEnv())
+        agent.load(path_weights)
+        return agent
+    raise ValueError('Unknown agent: ' + name)
+
+
+def _create_batch_evaluator(color, path_weights):
+    """BatchEvaluator of RlEnv features with the weights of an ApproxQAgent, or None without weights."""
+    if path_weights is None:
+        return None
+    agent = ApproxQAgent(color, RlEnv())
+    agent.load(path_weights)
+    return BatchEvaluator(RlEnv.extract_features, agent.w, RlEnv.extract_features_all)
+
+
+def _play_tournament_game(spec_black, spec_white, board_size, seed, turn_time, max_moves):
+    """Worker: play one seeded game between two agent specs (name, kwargs) and return the result."""
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    agent_black = create_agent(spec_black[0], 'BLACK', **spec_black[1])
+    agent_white = create_agent(spec_white[0], 'WHITE', **spec_white[1])
+    match = HeadlessMatch(agent_black, agent_white, board_size=board_size, turn_time=turn_time, max_moves=max_moves)
+    result = match.start()
+    return result['winner'], result['num_moves'], result['time_elapsed']
+
+
+def wilson_interval(wins, games, z=1.96):
+    """Wilson score interval of a win rate (95% by default)."""
+    if games == 0:
+        return 0., 1.
+    rate = wins / games
+    center = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    margin = z * math.sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / (1 + z * z / games)
+    return center - margin, center + margin
+
+
+def estimate_elo(wins, num_iters=1000, prior=0.5):
+    """
+    Estimate Elo ratings from a matrix of pairwise wins (wins[i][j]: games i won against j)
+    by fitting a Bradley-Terry model; ratings are centered on 0.
+    :param prior: virtual wins added for each side of every played pair, so unbeaten agents stay finite
+    """
+    wins = np.array(wins, dtype=float)
+    played = wins + wins.T
+    wins = wins + prior * (played > 0)
+    games = wins + wins.T
+    strength = np.ones(len(wins))
+    for _ in range(num_iters):
+        denominator = (games / (strength[:, None] + strength[None, :])).sum(axis=1)
+        updated = wins.sum(axis=1) / np.maximum(denominator, 1e-12)
+        updated /= np.exp(np.mean(np.log(np.maximum(updated, 1e-12))))
+        if np.allclose(updated, strength, rtol=1e-9):
+            break
+        strength = updated
+    elo = 400 * np.log10(np.maximum(strength, 1e-12))
+    return elo - elo.mean()
+
+
+class Tournament:
+    def __init__(self, agent_specs, num_games=10, board_size=19, turn_time=None, max_moves=None,
+                 num_workers=None, seed=0):
+        """
+        Round-robin between agents, with games fanned out over a process pool.
+        :param agent_specs: {label: (name, kwargs)} for create_agent, e.g. {'ab2': ('minimax', {'depth': 2})}
+        :param num_games: games per pair of agents; colors alternate between games
+        :param num_workers: number of worker processes; DEFAULT is one per core
+        :param seed: base seed; game k is seeded with seed + k
+        """
+        self.agent_specs = agent_specs
+        self.labels = list(agent_specs)
+        self.num_games = num_games
+        self.board_size = board_size
+        self.turn_time = turn_time
+        self.max_moves = max_moves
+        self.num_workers = num_workers or os.cpu_count()
+        self.seed = seed
+
+    def schedule(self):
+        """Return the list of games as (label_black, label_white, seed)."""
+        games = []
+        for label_a, label_b in combinations(self.labels, 2):
+            for i in range(self.num_games):
+                label_black, label_white = (label_a, label_b) if i % 2 == 0 else (label_b, label_a)
+                games.append((label_black, label_white, self.seed + len(games)))
+        return games
+
+    def run(self):
+        """Play all games and return the standings, see summarize."""
+        games = self.schedule()
+        print('Running %d games on %d workers' % (len(games), self.num_workers))
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(_play_tournament_game, self.agent_specs[label_black],
+                                       self.agent_specs[label_white], self.board_size, seed,
+                                       self.turn_time, self.max_moves)
+                       for label_black, label_white, seed in games]
+            results = [future.result() for future in futures]
+        return self.summarize(games, results)
+
+    def summarize(self, games, results):
+        """Aggregate win rates with 95% confidence intervals, mean moves and time, and Elo estimates."""
+        index = {label: i for i, label in enumerate(self.labels)}
+        wins = np.zeros((len(self.labels), len(self.labels)))
+        num_moves = {label: [] for label in self.labels}
+        time_elapsed = {label: [] for label in self.labels}
+        for (label_black, label_white, _), (winner, moves, time_game) in zip(games, results):
+            label_winner, label_loser = (label_black, label_white) if winner == 'BLACK' else (label_white, label_black)
+            wins[index[label_winner], index[label_loser]] += 1
+            for label in (label_black, label_white):
+                num_moves[label].append(moves)
+                time_elapsed[label].append(time_game)
+
+        elo = estimate_elo(wins)
+        standings = {}
+        for label, i in index.items():
+            num_wins = wins[i].sum()
+            num_played = num_wins + wins[:, i].sum()
+            win_rate = num_wins / num_played if num_played else 0.
+            standings[label] = {
+                'win_rate': win_rate,
+                'win_rate_ci': wilson_interval(num_wins, num_played),
+                'games': int(num_played),
+                'elo': elo[i],
+                'num_moves_mean': mean(num_moves[label]) if num_moves[label] else 0.,
+                'time_elapsed_mean': mean(time_elapsed[label]) if time_elapsed[label] else 0.,
+            }
+
+        for label in sorted(standings, key=lambda l: -standings[l]['elo']):
+            result = standings[label]
+            print('%s: Elo %+.0f; win rate %.3f [%.3f, %.3f] over %d games; avg # moves %.1f; avg time %.2f' %
+                  (label, result['elo'], result['win_rate'], result['win_rate_ci'][0], result['win_rate_ci'][1],
+                   result['games'], result['num_moves_mean'], result['time_elapsed_mean']))
+        return {'standings': standings, 'wins': wins, 'labels': self.labels}
+
+
+def measure_position_bytes(num_positions=200, board_size=19):
+    """
+    Report the mean bytes per position of Board.to_bytes() snapshots against pickled boards,
+    over positions sampled from random games.
+    """
+    list_snapshot = []
+    list_pickle = []
+    board = Board(board_size)
+    while len(list_snapshot) < num_positions:
+        actions = board.get_legal_actions()
+        if not actions or board.counter_move > board_size * board_size:
+            board = Board(board_size)
+            continue
+        board.put_stone(random.choice(actions), check_legal=False)
+        list_snapshot.append(len(board.to_bytes()))
+        list_pickle.append(len(pickle.dumps(board.copy())))
+
+    snapshot_mean = mean(list_snapshot)
+    pickle_mean = mean(list_pickle)
+    print('Bytes per position: snapshot %.1f; pickled Board %.1f' % (snapshot_mean, pickle_mean))
+    return snapshot_mean, pickle_mean
+
+
+def measure_successor_features(num_positions=20, board_size=19, num_random_moves=120, seed=0):
+    """
+    Time RlEnv.extract_features_all over all legal actions of positions from seeded random games,
+    with group and liberty counts from the incremental board aggregates and from get_batch_group_features.
+    :return: {'incremental': mean seconds per position, 'batched': mean seconds per position}
+    """
+    random.seed(seed)
+    positions = []
+    while len(positions) < num_positions:
+        board = Board(board_size)
+        for _ in range(num_random_moves):
+            actions = board.get_legal_actions()
+            if not actions:
+                break
+            board.play(random.choice(actions))
+        positions.append(board.copy())
+
+    results = {}
+    for name, batch_group_features in (('incremental', False), ('batched', True)):
+        time_start = time.time()
+        for board in positions:
+            RlEnv.extract_features_all(board, board.next, batch_group_features=batch_group_features)
+        results[name] = (time.time() - time_start) / num_positions
+        print('Successor features %s: %.4f s per position' % (name, results[name]))
+    return results
+
+
+def benchmark_search(max_depth=2, num_positions=5, board_size=9, num_random_moves=20, pruning_actions=12, seed=0):
+    """
+    Compare AlphaBetaAgent and PVSAgent on positions from seeded random games:
+    time to complete each depth and nodes searched per second.
+    :return: {agent name: {depth: (mean seconds per position, nodes per second)}}
+    """
+    random.seed(seed)
+    positions = []
+    while len(positions) < num_positions:
+        board = Board(board_size)
+        for _ in range(num_random_moves):
+            actions = board.get_legal_actions()
+            if not actions:
+                break
+            board.play(random.choice(actions))
+        positions.append(board.copy())
+
+    results = {}
+    for name, agent_class in (('alphabeta', AlphaBetaAgent), ('pvs', PVSAgent)):
+        results[name] = {}
+        for depth in range(1, max_depth + 1):
+            time_total = 0.
+            num_nodes = 0
+            for board in positions:
+                agent = agent_class(board.next, depth)
+                time_start = time.time()
+                agent.get_action(board, pruning_actions)
+                time_total += time.time() - time_start
+                num_nodes += agent.nodes
+            results[name][depth] = (time_total / num_positions, num_nodes / time_total if time_total > 0 else 0.)
+            print('%s depth %d: %.3f s to depth; %.0f nodes/s' % ((name, depth) + results[name][depth]))
+    return results
+
+
 if __name__ == '__main__':
     # agent_self = RandomAgent('BLACK')
     # agent_self = GreedyAgent('BLACK')
@@ -59,5 +319,20 @@ if __name__ == '__main__':
     agent_oppo = AlphaBetaAgent('BLACK', 1)
 
     benchmark = Benchmark(agent_self=agent_self, agent_oppo=agent_oppo)
-    win_mean, num_moves_mean, time_elapsed_mean = benchmark.run_benchmark(100, gui=True)
+    win_mean, num_moves_mean, time_elapsed_mean = benchmark.run_benchmark(100)
     print('Win rate: %f; Avg # moves: %f; Avg time: %f' % (win_mean, num_moves_mean, time_elapsed_mean))
+
+    # Alpha-beta against principal variation search
+    # benchmark_search(max_depth=2)
+
+    # Bytes per position of board snapshots against pickled boards
+    # measure_position_bytes()
+
+    # Successor features from the incremental aggregates against the batched group features
+    # measure_successor_features()
+
+    # Round-robin over several agents on all cores
+    # tournament = Tournament({'random': ('random', {}), 'greedy': ('greedy', {}),
+    #                          'minimax': ('minimax', {'depth': 1}), 'expectimax': ('expectimax', {'depth': 1})},
+    #                         num_games=20, board_size=9)
+    # tournament.run()
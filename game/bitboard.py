@@ -0,0 +1,209 @@
+from game.go import opponent_color, SCORING_RULES
+"""
+Rules-only reference backend of the game on bitboards; construct BitBoard directly.
+It implements the rules (put_stone, pass_move, is_valid_move, get_score) but none of the search API of
+game.go.Board (play/undo, copy, groups and liberty dicts), so agents and match runners use Board.
+Board, with its incremental groups and legal-move set, is also the faster engine for playing games.
+
+Stones of each color are kept as one Python big-int mask, with one bit per point.
+Rows are (size + 1) bits wide; the extra guard column is never on board,
+so shifting by 1 (x direction) or by a row width (y direction) never wraps around.
+"""
+
+
+class BitBoard(object):
+    """
+    Same rules and public interface as game.go.Board (simple ko, no superko),
+    with neighbor, liberty and flood-fill operations done as shifts over bitmasks.
+    """
+    def __init__(self, board_size=19, next_color='BLACK'):
+        if board_size not in [9, 13, 19]:
+            raise ValueError("Board size must be 9, 13, or 19")
+
+        self.size = board_size
+        self.width = board_size + 1  # bits per row, including the guard column
+        self.next = next_color
+        self.winner = None
+        self.counter_move = 0
+        self.last_move = None
+        self.ko_point = None
+        self.passes = 0  # Count consecutive passes for game end
+        self.captured_stones = {'BLACK': 0, 'WHITE': 0}  # Count captured stones
+        self.passes_count = {'BLACK': 0, 'WHITE': 0}  # Track total passes per player
+        self.komi = 6.5
+
+        self.stones = {'BLACK': 0, 'WHITE': 0}
+        self.on_board = 0
+        for y in range(self.size):
+            self.on_board |= ((1 << self.size) - 1) << (y * self.width)
+
+    @property
+    def board(self):
+        """List-of-lists view matching Board.board; built on demand."""
+        grid = [[None for _ in range(self.size + 1)] for _ in range(self.size + 1)]
+        for color in ('BLACK', 'WHITE'):
+            for x, y in self._to_points(self.stones[color]):
+                grid[x][y] = color
+        return grid
+
+    def is_valid_move(self, point):
+        """Check if a move is valid according to Go rules."""
+        x, y = point
+        if not (0 <= x < self.size and 0 <= y < self.size):
+            return False
+        bit = self._to_bit(point)
+        if (self.stones['BLACK'] | self.stones['WHITE']) & bit:
+            return False
+        if point == self.ko_point:
+            return False
+
+        own = self.stones[self.next] | bit
+        oppo = self.stones[self._get_opponent_color()]
+        empty = self.on_board & ~(own | oppo)
+        if self._dilate(bit) & empty:
+            return True
+        if self._find_captured(bit, oppo, empty):
+            return True
+        return self._dilate(self._flood(bit, own)) & empty != 0
+
+    def get_legal_actions(self):
+        """Return the list of valid moves for the player to move."""
+        empty = self.on_board & ~(self.stones['BLACK'] | self.stones['WHITE'])
+        return [point for point in self._to_points(empty) if self.is_valid_move(point)]
+
+    @property
+    def legal_actions(self):
+        return self.get_legal_actions()
+
+    def put_stone(self, point, check_legal=True):
+        """Place a stone and handle captures."""
+        if check_legal and not self.is_valid_move(point):
+            return False, []
+
+        self.passes = 0
+        color = self.next
+        opponent = self._get_opponent_color()
+        bit = self._to_bit(point)
+
+        self.stones[color] |= bit
+        empty = self.on_board & ~(self.stones[color] | self.stones[opponent])
+        captured = self._find_captured(bit, self.stones[opponent], empty)
+        self.stones[opponent] &= ~captured
+        captured_points = self._to_points(captured)
+
+        self.captured_stones[color] += len(captured_points)
+
+        self.ko_point = None
+        if len(captured_points) == 1 and self._flood(bit, self.stones[color]) == bit:
+            self.ko_point = captured_points[0]
+
+        self.last_move = point
+        self.next = opponent
+        self.counter_move += 1
+
+        return True, captured_points
+
+    def pass_move(self):
+        """Pass the current turn."""
+        self.passes += 1
+        self.passes_count[self.next] += 1
+
+        if self.passes_count[self.next] >= 3:
+            self.winner = opponent_color(self.next)
+            return True
+
+        self.next = self._get_opponent_color()
+        self.ko_point = None
+        return self.passes >= 2
+
+    def get_score(self, rule='territory'):
+        """Calculate the score using territory ('territory') or area ('area') scoring rules."""
+        if rule not in SCORING_RULES:
+            raise ValueError("Scoring rule must be one of %s" % (SCORING_RULES,))
+        territory = {'BLACK': 0, 'WHITE': 0}
+        empty = self.on_board & ~(self.stones['BLACK'] | self.stones['WHITE'])
+        while empty:
+            region = self._flood(empty & -empty, empty)
+            empty &= ~region
+            border = self._dilate(region)
+            touches_black = border & self.stones['BLACK'] != 0
+            touches_white = border & self.stones['WHITE'] != 0
+            if touches_black != touches_white:
+                territory['BLACK' if touches_black else 'WHITE'] += self._popcount(region)
+
+        if rule == 'area':
+            bonus = {color: self._popcount(self.stones[color]) for color in ('BLACK', 'WHITE')}
+        else:
+            bonus = self.captured_stones
+        final_score = {
+            'BLACK': territory['BLACK'] + bonus['BLACK'],
+            'WHITE': territory['WHITE'] + bonus['WHITE'] + self.komi  # Komi
+        }
+
+        return final_score
+
+    def get_board_state(self):
+        """Return the current board state."""
+        return self.board
+
+    def _get_opponent_color(self):
+        """Get the opponent's color."""
+        return 'WHITE' if self.next == 'BLACK' else 'BLACK'
+
+    def _to_bit(self, point):
+        return 1 << (point[1] * self.width + point[0])
+
+    def _to_points(self, mask):
+        """Decode a mask into a list of points."""
+        points = []
+        while mask:
+            low = mask & -mask
+            index = low.bit_length() - 1
+            points.append((index % self.width, index // self.width))
+            mask ^= low
+        return points
+
+    @staticmethod
+    def _popcount(mask):
+        return bin(mask).count('1')
+
+    def _dilate(self, mask):
+        """Return the on-board points adjacent to mask (excluding mask itself)."""
+        grown = (mask << 1) | (mask >> 1) | (mask << self.width) | (mask >> self.width)
+        return grown & self.on_board & ~mask
+
+    def _flood(self, seed, mask):
+        """Return the connected component of mask containing seed."""
+        region = seed
+        frontier = seed
+        while frontier:
+            frontier = self._dilate(frontier) & mask & ~region
+            region |= frontier
+        return region
+
+    def _find_captured(self, bit, oppo, empty):
+        """Return the mask of opponent stones adjacent to bit left without liberties."""
+        captured = 0
+        candidates = self._dilate(bit) & oppo
+        while candidates:
+            group = self._flood(candidates & -candidates, oppo)
+            candidates &= ~group
+            if not self._dilate(group) & empty:
+                captured |= group
+        return captured
+
+    def __str__(self):
+        """String representation of the board."""
+        grid = self.board
+        rows = []
+        for y in range(self.size):
+            row = []
+            for x in range(self.size):
+                if grid[x][y] == 'BLACK':
+                    row.append('B')
+                elif grid[x][y] == 'WHITE':
+                    row.append('W')
+                else:
+                    row.append('.')
+            rows.append(' '.join(row))
+        return '\n'.join(rows)
@@ -0,0 +1,86 @@
+from game.go import Board, opponent_color
+import time
+"""
+Headless match engine: plays two agents against each other without any GUI (no pygame import).
+"""
+
+
+class HeadlessMatch:
+    def __init__(self, agent_black, agent_white, board_size=19, turn_time=None, main_time=None,
+                 max_moves=None, scoring_rule='territory'):
+        """
+        :param agent_black: agent playing BLACK; must implement get_action(board)
+        :param agent_white: agent playing WHITE
+        :param board_size: 9, 13 or 19
+        :param turn_time: seconds allowed per move; a slower move is replaced by a pass, like Match.turn_timer
+        :param main_time: total seconds allowed per player; the player exceeding it loses
+        :param max_moves: stop the game after this many stones and score the position
+        :param scoring_rule: 'territory' or 'area', see Board.get_score
+        """
+        if agent_black.color != 'BLACK' or agent_white.color != 'WHITE':
+            raise ValueError('Must have one BLACK agent and one WHITE agent!')
+        self.agents = {'BLACK': agent_black, 'WHITE': agent_white}
+        self.board_size = board_size
+        self.turn_time = turn_time
+        self.main_time = main_time
+        self.max_moves = max_moves
+        self.scoring_rule = scoring_rule
+
+        self.board = Board(board_size=board_size, next_color='BLACK')
+        self.winner = None
+        self.score = None
+        self.time_elapsed = None
+        self.time_used = {'BLACK': 0., 'WHITE': 0.}
+        self.move_times = {'BLACK': [], 'WHITE': []}
+
+    @property
+    def next(self):
+        return self.board.next
+
+    @property
+    def counter_move(self):
+        return self.board.counter_move
+
+    def start(self):
+        """Play the game to the end and return the result (see get_result)."""
+        self.time_elapsed = time.time()
+        game_ended = False
+        while not game_ended and self.board.winner is None:
+            color = self.board.next
+            time_start = time.time()
+            action = self.agents[color].get_action(self.board)
+            time_move = time.time() - time_start
+            self.move_times[color].append(time_move)
+            self.time_used[color] += time_move
+
+            if self.main_time is not None and self.time_used[color] > self.main_time:
+                self.winner = opponent_color(color)  # Lost on time
+                break
+
+            if action is None or (self.turn_time is not None and time_move > self.turn_time):
+                game_ended = self.board.pass_move()
+            else:
+                success, _ = self.board.put_stone(action)
+                if not success:
+                    game_ended = self.board.pass_move()  # Illegal moves count as a pass
+
+            if self.max_moves is not None and self.board.counter_move >= self.max_moves:
+                break
+
+        self.time_elapsed = time.time() - self.time_elapsed
+        self.score = self.board.get_score(self.scoring_rule)
+        if self.winner is None:
+            self.winner = self.board.winner
+        if self.winner is None:
+            self.winner = 'BLACK' if self.score['BLACK'] > self.score['WHITE'] else 'WHITE'
+        return self.get_result()
+
+    def get_result(self):
+        """Return winner, number of moves, score, total time and per-move times of both players."""
+        return {
+            'winner': self.winner,
+            'num_moves': self.board.counter_move,
+            'score': self.score,
+            'time_elapsed': self.time_elapsed,
+            'move_times': self.move_times,
+        }
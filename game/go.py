@@ -1,11 +1,25 @@
 #!/usr/bin/env python
 from copy import deepcopy
+from array import array
+import random
+import struct
+import numpy as np
 from game.util import PointDict
 """
 This file is the full backend environment of the game.
 """
 
 BOARD_SIZE = 20  # number of rows/cols = BOARD_SIZE - 1
+SUPERKO_RULES = (None, 'positional', 'situational')
+COLORS = (None, 'BLACK', 'WHITE')  # small-int color codes used by compact encodings
+COLOR_CODES = {color: code for code, color in enumerate(COLORS)}
+SCORING_RULES = ('territory', 'area')
+
+# Snapshot header: size, next, winner, superko, passes, passes_count (B, W),
+# ko point, last move, counter_move, captured stones (B, W); followed by one color code per point
+_SNAPSHOT_HEADER = struct.Struct('<7B2h3H')
+
+_zobrist_tables = {}
 
 
 def opponent_color(color):
@@ -27,6 +41,66 @@ def neighbors(point, board_size):
     return [point for point in neighboring if 0 < point[0] < board_size and 0 < point[1] < board_size]
 
 
+def encode_point(point, board_size):
+    """Encode a point (or None) as a flat int (-1 for None)."""
+    return -1 if point is None else point[0] * board_size + point[1]
+
+
+def decode_point(index, board_size):
+    """Decode a flat int from encode_point back to a point."""
+    return None if index < 0 else divmod(index, board_size)
+
+
+def adjacent_to(mask):
+    """For a bool array of shape (..., size, size), mark the points with a 4-neighbor in mask."""
+    adjacent = np.zeros_like(mask)
+    adjacent[..., 1:, :] |= mask[..., :-1, :]
+    adjacent[..., :-1, :] |= mask[..., 1:, :]
+    adjacent[..., :, 1:] |= mask[..., :, :-1]
+    adjacent[..., :, :-1] |= mask[..., :, 1:]
+    return adjacent
+
+
+def label_regions(mask):
+    """
+    Label the 4-connected regions of a bool array of shape (..., size, size), without scipy.
+    Each region is labelled by the smallest flat index of its points; points outside mask get -1.
+    Labels are unique across the whole array, so stacked boards can be labelled in one call.
+    """
+    flat_mask = mask.ravel()
+    outside = flat_mask.size
+    labels = np.where(mask, np.arange(flat_mask.size).reshape(mask.shape), outside)
+    while True:
+        spread = labels.copy()
+        np.minimum(spread[..., 1:, :], labels[..., :-1, :], out=spread[..., 1:, :])
+        np.minimum(spread[..., :-1, :], labels[..., 1:, :], out=spread[..., :-1, :])
+        np.minimum(spread[..., :, 1:], labels[..., :, :-1], out=spread[..., :, 1:])
+        np.minimum(spread[..., :, :-1], labels[..., :, 1:], out=spread[..., :, :-1])
+        spread[~mask] = outside
+        # Pointer jumping: a label is the flat index of a point in the same region, so follow it
+        inside = spread < outside
+        spread[inside] = spread.ravel()[spread[inside]]
+        if np.array_equal(spread, labels):
+            break
+        labels = spread
+    labels[~mask] = -1
+    return labels
+
+
+def zobrist_table(board_size):
+    """
+    Return the Zobrist keys for a board size: {'BLACK': {point: key}, 'WHITE': {point: key}, 'TURN': key}.
+    Keys are 64-bit and seeded by the board size, so hashes agree across boards and processes.
+    """
+    if board_size not in _zobrist_tables:
+        rng = random.Random(board_size)
+        table = {color: {(x, y): rng.getrandbits(64) for x in range(board_size) for y in range(board_size)}
+                 for color in ('BLACK', 'WHITE')}
+        table['TURN'] = rng.getrandbits(64)  # XORed in when WHITE is to move
+        _zobrist_tables[board_size] = table
+    return _zobrist_tables[board_size]
+
+
 def cal_liberty(points, board):
     """Find and return the liberties of the point."""
     liberties = [point for point in neighbors(points, board.size)
@@ -35,6 +109,8 @@ def cal_liberty(points, board):
 
 
 class Group(object):
+    __slots__ = ('color', 'points', 'liberties', 'counted_liberties')
+
     def __init__(self, point, color, liberties):
         """
         Create and initialize a new group.
@@ -48,6 +124,7 @@ class Group(object):
         else:
             self.points = [point]
         self.liberties = liberties
+        self.counted_liberties = None  # liberty count under which Board.liberty_groups files the group
 
     @property
     def num_liberty(self):
@@ -78,11 +155,17 @@ class Board(object):
     2. Ko rule to prevent infinite loops
     3. Suicide rule prevention
     4. Territory scoring
+    5. Optional positional or situational superko, checked through Zobrist hashes
     """
-    def __init__(self, board_size=19, next_color='BLACK'):
-        """Initialize board with specified size (9x9, 13x13, or 19x19)"""
+    def __init__(self, board_size=19, next_color='BLACK', superko=None):
+        """
+        Initialize board with specified size (9x9, 13x13, or 19x19)
+        :param superko: None (simple ko only), 'positional' or 'situational'
+        """
         if board_size not in [9, 13, 19]:
             raise ValueError("Board size must be 9, 13, or 19")
+        if superko not in SUPERKO_RULES:
+            raise ValueError("Superko rule must be one of %s" % (SUPERKO_RULES,))
             
         self.size = board_size
         self.board = [[None for _ in range(self.size + 1)] for _ in range(self.size + 1)]
@@ -91,7 +174,6 @@ class Board(object):
         self.counter_move = 0
         self.last_move = None
         self.ko_point = None
-        self.last_board_state = None  # For ko rule checking
         self.passes = 0  # Count consecutive passes for game end
         self.captured_stones = {'BLACK': 0, 'WHITE': 0}  # Count captured stones
         self.passes_count = {'BLACK': 0, 'WHITE': 0}  # Track total passes per player
@@ -99,6 +181,46 @@ class Board(object):
         # Set komi to 6.5 for all board sizes
         self.komi = 6.5
 
+        # Group structures, updated incrementally on placement, capture and merge
+        self.groups = {'BLACK': [], 'WHITE': []}
+        self.stonedict = PointDict()  # point -> [group owning the stone]
+        self.libertydict = PointDict()  # point -> groups having the point as liberty
+        self.endangered_groups = []  # groups with only one liberty
+        # Running aggregates for evaluation: color -> {number of liberties: set of groups},
+        # number of (group, liberty) pairs and number of distinct liberty points of each color
+        self.liberty_groups = {'BLACK': {}, 'WHITE': {}}
+        self.num_liberty_links = {'BLACK': 0, 'WHITE': 0}
+        self.num_liberty_points = {'BLACK': 0, 'WHITE': 0}
+        self._neighbors = {(x, y): self._get_neighbors(x, y)
+                           for x in range(self.size) for y in range(self.size)}
+
+        # Zobrist hash of the stones on board, and the history of seen positions for superko
+        self.superko = superko
+        self.zobrist_hash = 0
+        self._zobrist = zobrist_table(self.size)
+        self.hash_history = {self._history_key(self.zobrist_hash, self.next)}
+
+        # Points passing the liberty rules for each color (ko and superko are checked on query);
+        # only points marked dirty by the last changes are re-examined
+        all_points = set(self._neighbors)
+        self._legal_points = {'BLACK': set(all_points), 'WHITE': set(all_points)}
+        self._dirty_points = set()
+
+        # Undo records pushed by play(); hash_history may be shared with copies until written
+        self.undo_stack = []
+        self._history_shared = False
+
+    @property
+    def situation_hash(self):
+        """Hash of the stones together with the player to move; suitable as a search cache key."""
+        return self.zobrist_hash ^ self._zobrist['TURN'] if self.next == 'WHITE' else self.zobrist_hash
+
+    def _history_key(self, zobrist_hash, next_color):
+        """Key recorded in hash_history: the situational hash under situational superko, else positional."""
+        if self.superko == 'situational' and next_color == 'WHITE':
+            return zobrist_hash ^ self._zobrist['TURN']
+        return zobrist_hash
+
     def is_valid_move(self, point):
         """Check if a move is valid according to Go rules."""
         x, y = point
@@ -112,65 +234,90 @@ class Board(object):
         # Check ko rule
         if point == self.ko_point:
             return False
-            
-        # Try the move
-        self.board[x][y] = self.next
-        
-        # Check if the move captures any opponent stones
-        opponent = self._get_opponent_color()
-        captured_groups = self._find_captured_groups(opponent)
-        
-        if captured_groups:
-            # Move is valid if it captures opponent stones
-            self.board[x][y] = None
-            return True
-            
-        # If no captures, check if the move is suicide
-        own_group = self._get_group(x, y)
-        if self._count_liberties(own_group) == 0:
-            # Move is suicide
-            self.board[x][y] = None
+
+        # Check suicide
+        if not self._is_legal_for(point, self.next):
+            return False
+
+        # Check superko
+        if self.superko and self._repeats_position(point):
             return False
-            
-        self.board[x][y] = None
         return True
 
-    def put_stone(self, point):
-        """Place a stone and handle captures."""
-        if not self.is_valid_move(point):
+    def get_legal_actions(self):
+        """Return the list of valid moves for the player to move."""
+        self._refresh_legal_points()
+        return [point for point in self._legal_points[self.next]
+                if point != self.ko_point and not (self.superko and self._repeats_position(point))]
+
+    @property
+    def legal_actions(self):
+        return self.get_legal_actions()
+
+    def _is_legal_for(self, point, color):
+        """
+        Check if color may play on the empty point under the liberty rules, ignoring ko:
+        the move needs an empty neighbor, a capture, or a connection to an own group with another liberty.
+        """
+        for nx, ny in self._neighbors[point]:
+            if self.board[nx][ny] is None:
+                return True
+        for group in self.libertydict.get_groups(opponent_color(color), point):
+            if group.num_liberty == 1:
+                return True
+        for group in self.libertydict.get_groups(color, point):
+            if group.num_liberty > 1:
+                return True
+        return False
+
+    def _repeats_position(self, point):
+        """Check if playing point would recreate a position in hash_history (superko)."""
+        opponent = self._get_opponent_color()
+        new_hash = self.zobrist_hash ^ self._zobrist[self.next][point]
+        for group in self.libertydict.get_groups(opponent, point):
+            if group.num_liberty == 1:
+                for stone in group.points:
+                    new_hash ^= self._zobrist[opponent][stone]
+        return self._history_key(new_hash, opponent) in self.hash_history
+
+    def _refresh_legal_points(self):
+        """Re-examine the dirty points for both colors."""
+        for point in self._dirty_points:
+            x, y = point
+            for color in ('BLACK', 'WHITE'):
+                if self.board[x][y] is None and self._is_legal_for(point, color):
+                    self._legal_points[color].add(point)
+                else:
+                    self._legal_points[color].discard(point)
+        self._dirty_points.clear()
+
+    def put_stone(self, point, check_legal=True):
+        """
+        Place a stone and handle captures.
+        :param check_legal: False to skip is_valid_move for points known to be legal (e.g. from get_legal_actions)
+        """
+        if check_legal and not self.is_valid_move(point):
             return False, []  # Return False and empty list of captured points
 
-        x, y = point
         self.passes = 0  # Reset pass counter
         
-        # Store current board state for ko rule
-        self.last_board_state = [row[:] for row in self.board]
-        
         # Place the stone
-        self.board[x][y] = self.next
         opponent = self._get_opponent_color()
+        group, touched_groups = self._add_stone(point, self.next)
         
-        # Find and remove captured opponent groups
+        # Remove opponent groups that lost their last liberty
         captured_points = []
-        captured_groups = self._find_captured_groups(opponent)
-        for group in captured_groups:
-            captured_points.extend(group)
-            self._remove_group(group)
-        
-        # If no opponent stones were captured, check if the placed stone's group is captured
-        if not captured_points:
-            own_group = self._get_group(x, y)
-            if self._count_liberties(own_group) == 0:
-                # Move is suicide, not allowed
-                self.board[x][y] = None
-                return False, []
+        for oppo_group in touched_groups:
+            if oppo_group.num_liberty == 0:
+                captured_points.extend(oppo_group.points)
+                self._remove_group(oppo_group)
         
         # Update captured stones count
         self.captured_stones[self.next] += len(captured_points)
         
         # Update ko point
         self.ko_point = None
-        if len(captured_points) == 1 and len(self._get_group(x, y)) == 1:
+        if len(captured_points) == 1 and len(group.points) == 1:
             # If exactly one stone was captured and the placed stone is alone,
             # mark the captured point as ko
             self.ko_point = captured_points[0]
@@ -178,6 +325,7 @@ class Board(object):
         self.last_move = point
         self.next = opponent
         self.counter_move += 1
+        self._add_history(self._history_key(self.zobrist_hash, self.next))
         
         return True, captured_points  # Return success and list of captured points
 
@@ -195,28 +343,150 @@ class Board(object):
         self.ko_point = None
         return self.passes >= 2  # Return True if game should end due to consecutive passes
 
-    def get_score(self):
-        """Calculate the score using territory scoring rules."""
-        territory = {'BLACK': 0, 'WHITE': 0}
-        counted = set()
-
-        # Count territory
-        for x in range(self.size):
-            for y in range(self.size):
-                if (x, y) not in counted and self.board[x][y] is None:
-                    territory_points = self._find_territory(x, y)
-                    if territory_points:
-                        counted.update(territory_points[0])
-                        territory[territory_points[1]] += len(territory_points[0])
-
-        # Add captured stones to score
+    def play(self, point):
+        """
+        Make a move (None to pass) that can be taken back by undo().
+        :return: same as put_stone
+        """
+        record = (point, self.next, self.ko_point, self.last_move, self.passes, self.winner,
+                  self.zobrist_hash, len(self.hash_history))
+        if point is None:
+            self.pass_move()
+            captured_points = []
+        else:
+            success, captured_points = self.put_stone(point)
+            if not success:
+                return False, []
+        self.undo_stack.append(record + (captured_points,))
+        return True, captured_points
+
+    def undo(self):
+        """Take back the last move made by play()."""
+        point, color, ko_point, last_move, passes, winner, zobrist_hash, len_history, captured_points = \
+            self.undo_stack.pop()
+        if point is None:
+            self.passes_count[color] -= 1
+        else:
+            if len(self.hash_history) > len_history:
+                self._discard_history(self._history_key(self.zobrist_hash, self.next))
+            # Lift the stone, splitting the group it joined, then put the captured stones back
+            group = self.stonedict.get_groups(color, point)[0]
+            self._remove_group(group)
+            for stone in group.points:
+                if stone != point:
+                    self._add_stone(stone, color)
+            for stone in captured_points:
+                self._add_stone(stone, opponent_color(color))
+            self.captured_stones[color] -= len(captured_points)
+            self.counter_move -= 1
+        self.next = color
+        self.ko_point = ko_point
+        self.last_move = last_move
+        self.passes = passes
+        self.winner = winner
+        self.zobrist_hash = zobrist_hash
+
+    def copy(self):
+        """
+        Return an independent copy of the board.
+        Lookup tables are shared, the position history is shared until either board writes to it,
+        and groups are cloned once; much cheaper than deepcopy. The copy starts with an empty undo stack.
+        """
+        board = Board.__new__(Board)
+        board.__dict__.update(self.__dict__)
+        board.board = [row[:] for row in self.board]
+        board.captured_stones = dict(self.captured_stones)
+        board.passes_count = dict(self.passes_count)
+        board._legal_points = {color: set(points) for color, points in self._legal_points.items()}
+        board._dirty_points = set(self._dirty_points)
+        board.undo_stack = []
+        self._history_shared = board._history_shared = True
+
+        clones = {}
+        board.groups = {'BLACK': [], 'WHITE': []}
+        board.stonedict = PointDict()
+        board.libertydict = PointDict()
+        for color, groups in self.groups.items():
+            for group in groups:
+                clone = Group(list(group.points), color, set(group.liberties))
+                clone.counted_liberties = group.counted_liberties
+                clones[id(group)] = clone
+                board.groups[color].append(clone)
+                for stone in clone.points:
+                    board.stonedict.set_groups(color, stone, [clone])
+            for point, shared in self.libertydict.get_items(color):
+                if shared:
+                    board.libertydict.set_groups(color, point, [clones[id(group)] for group in shared])
+        board.endangered_groups = [clones[id(group)] for group in self.endangered_groups]
+        board.liberty_groups = {color: {num_liberty: {clones[id(group)] for group in groups}
+                                        for num_liberty, groups in by_liberties.items()}
+                                for color, by_liberties in self.liberty_groups.items()}
+        board.num_liberty_links = dict(self.num_liberty_links)
+        board.num_liberty_points = dict(self.num_liberty_points)
+        return board
+
+    def generate_successor_state(self, action):
+        """Return a copy of the board with action (None to pass) applied."""
+        board = self.copy()
+        if action is None:
+            board.pass_move()
+        else:
+            board.put_stone(action)
+        return board
+
+    def _add_history(self, key):
+        if self._history_shared:
+            self.hash_history = set(self.hash_history)
+            self._history_shared = False
+        self.hash_history.add(key)
+
+    def _discard_history(self, key):
+        if self._history_shared:
+            self.hash_history = set(self.hash_history)
+            self._history_shared = False
+        self.hash_history.discard(key)
+
+    def get_score(self, rule='territory'):
+        """
+        Calculate the score.
+        :param rule: 'territory' (territory + captures, Japanese style) or 'area' (territory + stones, Chinese style)
+        """
+        if rule not in SCORING_RULES:
+            raise ValueError("Scoring rule must be one of %s" % (SCORING_RULES,))
+        grid = self.to_array()
+        territory = self._count_territory(grid)
+
+        if rule == 'area':
+            bonus = {color: int(np.count_nonzero(grid == COLOR_CODES[color])) for color in ('BLACK', 'WHITE')}
+        else:
+            bonus = self.captured_stones
         final_score = {
-            'BLACK': territory['BLACK'] + self.captured_stones['BLACK'],
-            'WHITE': territory['WHITE'] + self.captured_stones['WHITE'] + self.komi  # Komi
+            'BLACK': territory['BLACK'] + bonus['BLACK'],
+            'WHITE': territory['WHITE'] + bonus['WHITE'] + self.komi  # Komi
         }
 
         return final_score
 
+    def to_array(self):
+        """Return the position as an int8 array of color codes, indexed [x, y]."""
+        return np.array([[COLOR_CODES[self.board[x][y]] for y in range(self.size)] for x in range(self.size)],
+                        dtype=np.int8)
+
+    @staticmethod
+    def _count_territory(grid):
+        """Count the empty points in regions bordered by stones of only one color."""
+        empty = grid == 0
+        labels = label_regions(empty)[empty]
+        territory = {}
+        touches = {}
+        for color in ('BLACK', 'WHITE'):
+            next_to_color = adjacent_to(grid == COLOR_CODES[color])[empty]
+            touches[color] = np.bincount(labels[next_to_color], minlength=grid.size) > 0
+        for color, other in (('BLACK', 'WHITE'), ('WHITE', 'BLACK')):
+            owned = touches[color] & ~touches[other]
+            territory[color] = int(np.count_nonzero(owned[labels]))
+        return territory
+
     def _get_opponent_color(self):
         """Get the opponent's color."""
         return 'WHITE' if self.next == 'BLACK' else 'BLACK'
@@ -230,80 +500,178 @@ class Board(object):
                 neighbors.append((nx, ny))
         return neighbors
 
-    def _get_group(self, x, y):
-        """Get all connected stones of the same color."""
-        if self.board[x][y] is None:
-            return set()
-
-        color = self.board[x][y]
-        group = {(x, y)}
-        frontier = [(x, y)]
-
-        while frontier:
-            current = frontier.pop()
-            for nx, ny in self._get_neighbors(*current):
-                if self.board[nx][ny] == color and (nx, ny) not in group:
-                    group.add((nx, ny))
-                    frontier.append((nx, ny))
-        return group
-
-    def _count_liberties(self, group):
-        """Count the number of liberties for a group of stones."""
-        liberties = set()
-        for x, y in group:
-            for nx, ny in self._get_neighbors(x, y):
-                if self.board[nx][ny] is None:
-                    liberties.add((nx, ny))
-        return len(liberties)
-
-    def _find_captured_groups(self, color):
-        """Find all groups of the given color that have been captured."""
-        captured = []
-        checked = set()
-
-        for x in range(self.size):
-            for y in range(self.size):
-                if (x, y) not in checked and self.board[x][y] == color:
-                    group = self._get_group(x, y)
-                    checked.update(group)
-                    if self._count_liberties(group) == 0:
-                        captured.append(list(group))
-        return captured
+    def _add_stone(self, point, color):
+        """
+        Place a stone without resolving captures, merging it with adjacent groups of the same color.
+        :return: the group now owning the stone, and the adjacent opponent groups that lost a liberty
+        """
+        x, y = point
+        self.board[x][y] = color
+        self.zobrist_hash ^= self._zobrist[color][point]
+        oppo = opponent_color(color)
+
+        # Merge adjacent self groups into the largest one
+        self_groups = self.libertydict.get_groups(color, point)
+        self.libertydict.remove_point(color, point)
+        if self_groups:
+            self.num_liberty_points[color] -= 1
+            group = max(self_groups, key=lambda g: len(g.points))
+            group.points.append(point)
+            group.liberties.discard(point)
+            for other in self_groups:
+                if other is not group:
+                    self._merge_group(group, other, point)
+        else:
+            group = Group(point, color, set())
+            self.groups[color].append(group)
+
+        # New liberties from the placed stone
+        for neighbor in self._neighbors[point]:
+            if self.board[neighbor[0]][neighbor[1]] is None and neighbor not in group.liberties:
+                group.liberties.add(neighbor)
+                self._link_liberty(color, neighbor, group)
+        self.stonedict.set_groups(color, point, [group])
+        self._update_group_stats(group)
+
+        # The point is no longer a liberty of adjacent opponent groups
+        oppo_groups = self.libertydict.get_groups(oppo, point)
+        self.libertydict.remove_point(oppo, point)
+        if oppo_groups:
+            self.num_liberty_points[oppo] -= 1
+        for oppo_group in oppo_groups:
+            oppo_group.liberties.discard(point)
+            self._update_group_stats(oppo_group)
+            self._dirty_points.update(oppo_group.liberties)
+
+        self._dirty_points.add(point)
+        self._dirty_points.update(self._neighbors[point])
+        self._dirty_points.update(group.liberties)
+        return group, oppo_groups
+
+    def _merge_group(self, group, other, point):
+        """Merge other into group; point is the connecting stone already added to group."""
+        other.liberties.discard(point)
+        group.add_stones(other.points)
+        for stone in other.points:
+            self.stonedict.set_groups(group.color, stone, [group])
+        for liberty in other.liberties:
+            shared = self.libertydict.get_groups(group.color, liberty)
+            shared.remove(other)
+            if liberty not in group.liberties:
+                group.liberties.add(liberty)
+                shared.append(group)
+        self.groups[group.color].remove(other)
+        self._forget_group(other)
 
     def _remove_group(self, group):
-        """Remove a group of stones from the board."""
-        for x, y in group:
+        """Remove a group of stones from the board, giving liberties back to adjacent groups."""
+        color = group.color
+        oppo = opponent_color(color)
+        self._dirty_points.update(group.points)
+        self._dirty_points.update(group.liberties)
+        for liberty in group.liberties:
+            shared = self.libertydict.get_groups(color, liberty)
+            shared.remove(group)
+            if not shared:
+                self.libertydict.remove_point(color, liberty)
+                self.num_liberty_points[color] -= 1
+        for x, y in group.points:
             self.board[x][y] = None
-
-    def _find_territory(self, x, y):
-        """Find territory points and determine owner.
-        Returns (territory_points, owner) or None if territory is neutral."""
-        if self.board[x][y] is not None:
-            return None
-
-        territory = {(x, y)}
-        frontier = [(x, y)]
-        borders = set()
-
-        while frontier:
-            current = frontier.pop()
-            for nx, ny in self._get_neighbors(*current):
-                if self.board[nx][ny] is None:
-                    if (nx, ny) not in territory:
-                        territory.add((nx, ny))
-                        frontier.append((nx, ny))
-                else:
-                    borders.add(self.board[nx][ny])
-
-        # Territory must be surrounded by stones of only one color
-        if len(borders) == 1:
-            return (territory, list(borders)[0])
-        return None
+            self.stonedict.remove_point(color, (x, y))
+            self.zobrist_hash ^= self._zobrist[color][(x, y)]
+        for point in group.points:
+            for nx, ny in self._neighbors[point]:
+                if self.board[nx][ny] == oppo:
+                    oppo_group = self.stonedict.get_groups(oppo, (nx, ny))[0]
+                    if point not in oppo_group.liberties:
+                        oppo_group.liberties.add(point)
+                        self._link_liberty(oppo, point, oppo_group)
+                        self._update_group_stats(oppo_group)
+                        self._dirty_points.update(oppo_group.liberties)
+        self.groups[color].remove(group)
+        self._forget_group(group)
+
+    def _link_liberty(self, color, point, group):
+        """Record point as a liberty of group in libertydict."""
+        shared = self.libertydict.get_groups(color, point)
+        shared.append(group)
+        if len(shared) == 1:
+            self.num_liberty_points[color] += 1
+
+    def _update_group_stats(self, group):
+        """Keep endangered_groups and the liberty aggregates in sync with the liberty count of group."""
+        num_liberty = group.num_liberty
+        if group.counted_liberties != num_liberty:
+            by_liberties = self.liberty_groups[group.color]
+            if group.counted_liberties is not None:
+                by_liberties[group.counted_liberties].discard(group)
+                self.num_liberty_links[group.color] -= group.counted_liberties
+            by_liberties.setdefault(num_liberty, set()).add(group)
+            self.num_liberty_links[group.color] += num_liberty
+            group.counted_liberties = num_liberty
+
+        if num_liberty == 1:
+            if group not in self.endangered_groups:
+                self.endangered_groups.append(group)
+        elif group in self.endangered_groups:
+            self.endangered_groups.remove(group)
+
+    def _forget_group(self, group):
+        """Drop a merged or removed group from endangered_groups and the liberty aggregates."""
+        if group.counted_liberties is not None:
+            self.liberty_groups[group.color][group.counted_liberties].discard(group)
+            self.num_liberty_links[group.color] -= group.counted_liberties
+            group.counted_liberties = None
+        if group in self.endangered_groups:
+            self.endangered_groups.remove(group)
+
+    def get_num_groups_with_liberties(self, color, num_liberty):
+        """Number of groups of color with exactly num_liberty liberties; O(1)."""
+        return len(self.liberty_groups[color].get(num_liberty, ()))
+
+    def get_num_shared_liberties(self, color):
+        """Sum over the liberty points of color of the number of groups sharing the point, minus one; O(1)."""
+        return self.num_liberty_links[color] - self.num_liberty_points[color]
 
     def get_board_state(self):
         """Return the current board state."""
         return [row[:] for row in self.board]
 
+    def to_bytes(self):
+        """
+        Pack the position into a compact snapshot: a fixed header followed by
+        one signed byte (color code) per point, in encode_point order.
+        The undo stack and the superko history beyond the current position are not kept.
+        """
+        header = _SNAPSHOT_HEADER.pack(
+            self.size, COLOR_CODES[self.next], COLOR_CODES[self.winner], SUPERKO_RULES.index(self.superko),
+            self.passes, self.passes_count['BLACK'], self.passes_count['WHITE'],
+            encode_point(self.ko_point, self.size), encode_point(self.last_move, self.size),
+            self.counter_move, self.captured_stones['BLACK'], self.captured_stones['WHITE'])
+        stones = array('b', [COLOR_CODES[self.board[x][y]] for x in range(self.size) for y in range(self.size)])
+        return header + stones.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Rebuild a board, including its groups and hash, from a to_bytes() snapshot."""
+        size, next_code, winner_code, superko_code, passes, passes_black, passes_white, \
+            ko_index, last_index, counter_move, captured_black, captured_white = _SNAPSHOT_HEADER.unpack_from(data)
+        board = cls(size, COLORS[next_code], superko=SUPERKO_RULES[superko_code])
+        stones = array('b')
+        stones.frombytes(data[_SNAPSHOT_HEADER.size:])
+        for index, code in enumerate(stones):
+            if code:
+                board._add_stone(decode_point(index, size), COLORS[code])
+        board.winner = COLORS[winner_code]
+        board.passes = passes
+        board.passes_count = {'BLACK': passes_black, 'WHITE': passes_white}
+        board.ko_point = decode_point(ko_index, size)
+        board.last_move = decode_point(last_index, size)
+        board.counter_move = counter_move
+        board.captured_stones = {'BLACK': captured_black, 'WHITE': captured_white}
+        board.hash_history = {board._history_key(board.zobrist_hash, board.next)}
+        return board
+
     def __str__(self):
         """String representation of the board."""
         rows = []
@@ -349,7 +349,6 @@ class Match:
         """Advanced AI player with strategic move selection."""
         import random
         import math
-        import copy
 
         def evaluate_move(point, color):
             """Evaluate the strategic value of a potential move."""
@@ -371,10 +370,9 @@ class Match:
                             nearby_stones += 1
             score += nearby_stones * 2
             
-            # Potential stone capture
-            test_board = copy.deepcopy(self.board)
-            test_board.board[x][y] = color
-            captured_groups = test_board._find_captured_groups(opponent_color(color))
+            # Potential stone capture: opponent groups whose last liberty is this point
+            captured_groups = [group for group in self.board.libertydict.get_groups(opponent_color(color), point)
+                               if group.num_liberty == 1]
             score += len(captured_groups) * 10
             
             # Territory control (proximity to board center)
@@ -389,11 +387,7 @@ class Match:
             return score
 
         # Find all valid moves
-        valid_moves = []
-        for i in range(self.board_size):
-            for j in range(self.board_size):
-                if self.board.is_valid_move((i, j)):
-                    valid_moves.append((i, j))
+        valid_moves = self.board.get_legal_actions()
         
         if not valid_moves:
             # If no valid moves, pass
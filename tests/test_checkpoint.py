@@ -0,0 +1,45 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from agent.rl.rl_env import RlEnv, RlEnv2
+from agent.rl.checkpoint import save_training_checkpoint, resume_training
+
+
+class TestResumeTraining(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'checkpoint.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_without_checkpoint_keeps_state(self):
+        w = np.ones(RlEnv.get_num_feats())
+        self.assertEqual(resume_training(self.path, w, RlEnv(), 0.01, 0.2), (w, 0.01, 0.2, 0))
+
+    def test_resume_restores_training_and_rng_state(self):
+        w = np.arange(RlEnv.get_num_feats(), dtype=float)
+        random.seed(3)
+        np.random.seed(3)
+        save_training_checkpoint(self.path, w, RlEnv(), 4, 0.005, 0.1)
+        expected = random.random(), np.random.random()
+
+        resumed_w, lr, exploration_rate, start_epoch = resume_training(self.path, np.zeros_like(w), RlEnv(), 1., 1.)
+        np.testing.assert_array_equal(resumed_w, w)
+        self.assertEqual((lr, exploration_rate, start_epoch), (0.005, 0.1, 5))
+        self.assertEqual((random.random(), np.random.random()), expected)
+
+    def test_rejects_other_env_or_size(self):
+        w = np.zeros(RlEnv.get_num_feats())
+        save_training_checkpoint(self.path, w, RlEnv(), 0, 0.01, 0.1)
+        with self.assertRaises(ValueError):
+            resume_training(self.path, np.zeros(2 * RlEnv2.get_num_feats()), RlEnv2(), 0.01, 0.1)
+        with self.assertRaises(ValueError):
+            resume_training(self.path, np.zeros(len(w) + 1), RlEnv(), 0.01, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
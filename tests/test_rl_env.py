@@ -0,0 +1,49 @@
+import random
+import unittest
+import numpy as np
+from game.go import Board, opponent_color
+from agent.util import stack_boards, get_batch_group_features, get_num_groups_with_k_liberties, \
+    get_num_shared_liberties, get_dangerous_liberties, calc_group_liberty_var
+from agent.rl.rl_env import RlEnv
+
+
+def _random_board(board_size, num_moves, seed):
+    rng = random.Random(seed)
+    board = Board(board_size)
+    for _ in range(num_moves):
+        actions = board.get_legal_actions()
+        if not actions:
+            break
+        board.put_stone(rng.choice(actions))
+    return board
+
+
+class TestBatchGroupFeatures(unittest.TestCase):
+    def test_matches_board_aggregates(self):
+        boards = [_random_board(9, num_moves, seed) for seed, num_moves in enumerate((0, 10, 25, 40, 60))]
+        for color in ('BLACK', 'WHITE'):
+            group_feats = get_batch_group_features(stack_boards(boards), color)
+            for i, board in enumerate(boards):
+                groups = board.groups[color]
+                self.assertEqual(group_feats['num_groups'][i], len(groups))
+                self.assertEqual(group_feats['num_endangered'][i], get_num_groups_with_k_liberties(board, color, 1)[0])
+                self.assertEqual(group_feats['num_groups_2lbt'][i], get_num_groups_with_k_liberties(board, color, 2)[0])
+                self.assertEqual(group_feats['num_shared_liberties'][i], get_num_shared_liberties(board, color)[0])
+                self.assertEqual(group_feats['num_dangerous_liberties'][i], len(get_dangerous_liberties(board, color)))
+                if groups:
+                    self.assertAlmostEqual(group_feats['liberty_var_mean'][i],
+                                           np.mean([calc_group_liberty_var(group) for group in groups]))
+                else:
+                    self.assertTrue(np.isnan(group_feats['liberty_var_mean'][i]))
+
+    def test_batched_successor_features_match(self):
+        for board_size, num_moves in ((9, 30), (13, 60)):
+            board = _random_board(board_size, num_moves, seed=board_size)
+            for color in (board.next, opponent_color(board.next)):
+                np.testing.assert_allclose(RlEnv.extract_features_all(board, color),
+                                           RlEnv.extract_features_all(board, color, batch_group_features=False),
+                                           rtol=1e-12, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import random
+import unittest
+import numpy as np
+from game.go import Board
+from agent.search.evaluation import evaluate_deterministic, BatchEvaluator
+from agent.search.search_agent import AlphaBetaAgent, ExpectimaxAgent, PVSAgent
+from agent.search.transposition import LOWER
+from agent.rl.rl_env import RlEnv, RlEnv2
+
+
+def _random_board(board_size=9, num_moves=20, seed=0):
+    rng = random.Random(seed)
+    board = Board(board_size)
+    for _ in range(num_moves):
+        board.put_stone(rng.choice(board.get_legal_actions()))
+    return board
+
+
+def _per_leaf_q(weights):
+    """The evaluation a BatchEvaluator of RlEnv features performs, one leaf and one action at a time."""
+    def eval_func(board, color):
+        legal_actions = board.get_legal_actions()
+        if board.winner is not None or board.next != color or not legal_actions:
+            return evaluate_deterministic(board, color)
+        return max(weights.dot(RlEnv.extract_features(board, action, color)) for action in legal_actions)
+    return eval_func
+
+
+def _search(agent_class, depth, weights, batched, seed, pruning_actions=3):
+    # Without move ordering and transposition table, rounding differences between the two paths
+    # cannot change which actions are searched. The board is set up again for each search,
+    # as the order of its legal actions depends on the moves played on it
+    board = _random_board(num_moves=30, seed=seed)
+    color = board.next
+    random.seed(1)  # Seeds the random pruning
+    if batched:
+        features_all_func = RlEnv.extract_features_all if batched == 'all' else None
+        agent = agent_class(color, depth, evaluate_deterministic, tt_memory_mb=0, move_ordering=False,
+                            batch_evaluator=BatchEvaluator(RlEnv.extract_features, weights, features_all_func))
+    else:
+        agent = agent_class(color, depth, _per_leaf_q(weights), tt_memory_mb=0, move_ordering=False)
+    agent.pruning_actions = pruning_actions
+    agent._new_search(board)
+    agent.horizon = depth
+    if agent_class is AlphaBetaAgent:
+        return agent.max_value(board, 0, float("-inf"), float("inf"))
+    return agent.max_value(board, 0)
+
+
+class TestBatchEvaluator(unittest.TestCase):
+    def test_batched_leaves_match_per_leaf_eval(self):
+        weights = np.random.RandomState(0).normal(size=RlEnv.get_num_feats())
+        for seed in range(2):
+            for agent_class in (AlphaBetaAgent, ExpectimaxAgent):
+                for depth in (1, 2):
+                    score, actions = _search(agent_class, depth, weights, False, seed)
+                    for batched in (True, 'all'):
+                        batched_score, batched_actions = _search(agent_class, depth, weights, batched, seed)
+                        self.assertAlmostEqual(score, batched_score)
+                        self.assertEqual(actions[:1], batched_actions[:1])
+
+    def test_batch_matches_per_action_scores(self):
+        board = _random_board(seed=3)
+        weights = np.random.RandomState(1).normal(size=RlEnv.get_num_feats())
+        actions = board.get_legal_actions()
+        expected = [weights.dot(RlEnv.extract_features(board, action, board.next)) for action in actions]
+        for evaluator in (BatchEvaluator(RlEnv.extract_features, weights),
+                          BatchEvaluator(RlEnv.extract_features, weights, RlEnv.extract_features_all)):
+            np.testing.assert_allclose(evaluator.evaluate_actions(board, actions, board.next), expected)
+
+    def test_rejects_tuple_features(self):
+        board = _random_board(seed=4)
+        evaluator = BatchEvaluator(RlEnv2.extract_features, np.zeros(2 * RlEnv2.get_num_feats()))
+        with self.assertRaises(ValueError):
+            evaluator.evaluate_actions(board, board.get_legal_actions()[:2], board.next)
+        evaluator = BatchEvaluator(RlEnv2.extract_features, np.zeros(2 * RlEnv2.get_num_feats()),
+                                   RlEnv2.extract_features_all)
+        with self.assertRaises(ValueError):
+            evaluator.evaluate_actions(board, board.get_legal_actions()[:2], board.next)
+
+
+class TestParallelRoot(unittest.TestCase):
+    def _search_root(self, seed, noise_seed):
+        np.random.seed(noise_seed)  # The state of the parent process must not matter
+        results = []
+        for board_seed in range(3):
+            board = _random_board(num_moves=20, seed=board_seed)
+            agent = AlphaBetaAgent(board.next, 2, num_workers=3, seed=seed)
+            try:
+                agent.pruning_actions = 6
+                agent._new_search(board)
+                results.append(agent._search_root(board))
+            finally:
+                agent.close()
+        return results
+
+    def test_same_seed_same_actions(self):
+        self.assertEqual(self._search_root(7, 0), self._search_root(7, 1))
+
+class TestStoredMoves(unittest.TestCase):
+    def test_illegal_stored_move_is_not_searched(self):
+        board = _random_board(num_moves=20, seed=5)
+        occupied = next((x, y) for x in range(board.size) for y in range(board.size) if board.board[x][y])
+        grid = board.to_array()
+        for agent_class in (AlphaBetaAgent, ExpectimaxAgent, PVSAgent):
+            for move_ordering in (True, False):
+                agent = agent_class(board.next, 2, move_ordering=move_ordering)
+                agent.pruning_actions = 4
+                agent._new_search(board)
+                self.assertNotIn(occupied, agent._get_actions(board, occupied))
+                # A stored best move that is not legal, like a ko retake under the same hash
+                agent.transposition_table.store(board.situation_hash, 0, 0., LOWER, occupied)
+                if agent_class is AlphaBetaAgent:
+                    score, actions = agent.max_value(board, 0, float("-inf"), float("inf"))
+                elif agent_class is ExpectimaxAgent:
+                    score, actions = agent.max_value(board, 0)
+                else:
+                    agent.pv_length = [0] * 4
+                    agent.pv_table = [[None] * 4 for _ in range(4)]
+                    agent.pvs(board, 0, 2, float("-inf"), float("inf"))
+                    actions = agent.pv_table[0][:agent.pv_length[0]]
+                self.assertNotEqual(actions[0], occupied)
+                self.assertEqual(len(board.undo_stack), 0)
+                np.testing.assert_array_equal(board.to_array(), grid)
+
+
+if __name__ == '__main__':
+    unittest.main()